@@ -76,6 +76,9 @@ if __name__ == '__main__':
     state_addr = make_addr('state')
     control_addr = make_addr('control')
 
+    # One keep-alive connection for all the polling
+    session = requests.Session()
+
     while True:
         r_lobby = requests.post(lobby_addr, json=dict(name=args.name,
                                                       team=args.team,
@@ -107,21 +110,27 @@ if __name__ == '__main__':
                 break
 
         status = r_state.json().get('state')
+        frame_id = r_state.headers.get('X-Frame-Id', '')
 
         while status != 'finished':
-            r_state = requests.get(state_addr,
-                                   params=dict(game=lobby_response['game']))
+            # Long poll: the server holds the request until there is a frame
+            # newer than the last one we saw (204 if none for a while)
+            r_state = session.get(state_addr,
+                                  params=dict(game=lobby_response['game'],
+                                              after=frame_id))
             r_state.raise_for_status()
+            if r_state.status_code == 204:
+                continue
+            frame_id = r_state.headers.get('X-Frame-Id', '')
             game_state = r_state.json()
             logger.debug('Current state "{}"'.format(pformat(game_state)))
             status = game_state.get('state')
             if status == 'queued':
-                sleep(1)  # wait a sec so we're not slamming the server
                 continue
             linear, rotation = agent_action(game_state)
             control_data = dict(password=args.password,
                                 linear=linear,
                                 rotation=rotation)
             logger.debug('Sending control data "{}"'.format(control_data))
-            r_control = requests.post(control_addr, json=control_data)
+            r_control = session.post(control_addr, json=control_data)
             r_state.raise_for_status()
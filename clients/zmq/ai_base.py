@@ -25,8 +25,9 @@ def main(args):
     response = game.lobby.register(args.ship_name, args.team_name,
                                     args.password)
     print(response)
-    # Subscribe to the game state
-    game.state.subscribe(response.game)
+    # Subscribe to the game state, keeping only the newest frame so the
+    # sleep below never leaves us acting on old states
+    game.state.subscribe(response.game).conflate()
 
     # load the map:
     mapname = response['map']
@@ -46,11 +47,11 @@ def main(args):
     timeStart = 0.
     while True:
         print('Getting state')
-        state = game.state.recv()
+        state = game.state.recv_array()
         print('Got state')
 
         # Idle until game start
-        if state['state'] != 'running':
+        if state.state != 'running':
             if not go:
                 print('Race over...')
                 break
@@ -62,8 +63,8 @@ def main(args):
             continue
 
         # Control the attitude of the craft
-        alldata = state['data']
-        data = alldata[my_name]  # find self in the list
+        # state.ships holds every ship, one row per id in state.ids
+        data = state.row(my_name)  # find self in the list
         ship_x = data['x']
         ship_y = data['y']
         ship_vx = data['vx']
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# aio_client.py
+#
+# asyncio versions of the clients in client.py, on zmq.asyncio sockets, so
+# one process can run many ships in many games at once:
+#
+#   async with AsyncClient(hostname, lobby_port, control_port,
+#                          state_port) as game:
+#       response = await game.lobby.register(ship, team, password)
+#       async for frame in game.state_client(response.game).states():
+#           await game.control.send(password, 1, 0)
+#
+# Run as a script it races a fleet of random dummy ships.
+
+import asyncio
+import collections
+import json
+import logging
+import random
+import time
+import zmq
+import zmq.asyncio
+
+from client import (DEFAULTS, BaseClient, Bunch, StateClient, make_address,
+                    make_control_str, make_handshake_msg, make_random_name)
+from codec import DECODERS, TABLE, topic
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+def make_context():
+    context = zmq.asyncio.Context()
+    context.linger = 0
+    return context
+
+
+class AsyncClient:
+
+    def __init__(self, hostname, lobby_port, control_port, state_port,
+                 context=None):
+
+        if context is None:
+            self.context = make_context()
+        else:
+            self.context = context
+
+        self.hostname = hostname
+        self.state_port = state_port
+        self.lobby = AsyncLobbyClient(hostname, lobby_port, self.context)
+        self.control = AsyncControlClient(hostname, control_port,
+                                          self.context)
+        self.state = AsyncStateClient(hostname, state_port, self.context)
+
+    def state_client(self, game_name=None, encoding='json'):
+        """ A new state subscriber, for following a game of its own. """
+        client = AsyncStateClient(self.hostname, self.state_port,
+                                  self.context)
+        if game_name is not None:
+            client.subscribe(game_name, encoding)
+        return client
+
+    def close(self):
+        self.state.close()
+        self.control.close()
+        self.lobby.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class AsyncBaseClient(BaseClient):
+
+    def __init__(self, hostname, port, context=None):
+        BaseClient.__init__(self, hostname, port, context or make_context())
+
+
+class AsyncLobbyClient(AsyncBaseClient):
+    """ Registrations over a pool of DEALER sockets.
+
+    Each register() call takes a socket of its own, so any number can be in
+    flight together and a reply always belongs to the one request on its
+    socket. A socket whose request timed out (or was cancelled) is closed
+    rather than reused, so its late reply can't reach a later request.
+
+    Args:
+        size - idle sockets to keep for reuse
+    """
+
+    def __init__(self, hostname, port, context=None, size=8):
+        AsyncBaseClient.__init__(self, hostname, port, context)
+        self.address = make_address(hostname, port)
+        self.size = size
+        self.idle = [self.sock]
+
+    def make_socket(self):
+        return self.context.socket(zmq.DEALER)
+
+    def _checkout(self):
+        if self.idle:
+            return self.idle.pop()
+        sock = self.make_socket()
+        sock.connect(self.address)
+        return sock
+
+    def _checkin(self, sock):
+        if len(self.idle) < self.size:
+            self.idle.append(sock)
+        else:
+            sock.close()
+
+    async def register(self, ship_name, team_name, password, timeout=None):
+        """ Register a ship, returning the lobby's response as a Bunch.
+
+        Raises asyncio.TimeoutError after timeout seconds (if given).
+        """
+        logger.debug('Registering ship "{}" under team "{}"'.format(
+            ship_name, team_name))
+        handshake = make_handshake_msg(ship_name, team_name, password)
+        sock = self._checkout()
+        try:
+            await sock.send_multipart([b'', json.dumps(handshake).encode()])
+            empty, msg_b = await asyncio.wait_for(sock.recv_multipart(),
+                                                  timeout)
+        except BaseException:
+            sock.close()  # its reply may still turn up, so never reuse it
+            raise
+        self._checkin(sock)
+        response = json.loads(msg_b.decode())
+        logger.debug('Got "{}"'.format(response))
+        return Bunch(**response)
+
+    def close(self):
+        for sock in self.idle:
+            sock.close()
+        self.idle = []
+
+
+class AsyncControlClient(AsyncBaseClient):
+
+    def make_socket(self):
+        return self.context.socket(zmq.PUSH)
+
+    async def send(self, secret_key, linear, rotational):
+        await self.sock.send_string(make_control_str(secret_key, linear,
+                                                     rotational))
+
+
+class AsyncStateClient(AsyncBaseClient, StateClient):
+    """ StateClient whose recv methods are coroutines, with states() an
+    async iterator over a game's frames. conflate() reads in a task on the
+    same loop rather than a thread, and latest() is awaited.
+    """
+
+    def subscribe(self, game_name, encoding='json'):
+        # The reader task runs on this thread, so the socket is ours to set
+        if encoding not in DECODERS:
+            raise ValueError('Unknown state encoding "{}"'.format(encoding))
+        self.encoding = encoding
+        self.sock.setsockopt_string(zmq.SUBSCRIBE, topic(game_name, encoding))
+        return self
+
+    async def recv_frame(self, out=None):
+        if self.reader is not None:
+            return (await self.latest(out=out))[0]
+        while True:
+            msg_filter_b, msg_b = await self.sock.recv_multipart(copy=False)
+            decoder = self.decoder(msg_filter_b.bytes.decode())
+            if decoder is None:
+                continue
+            frame = decoder.decode(msg_b.buffer, out)
+            if frame is not None:
+                return frame
+
+    async def recv_array(self):
+        frame = await self.recv_frame(self.ships)
+        self._keep(frame)
+        return frame
+
+    async def recv(self):
+        return (await self.recv_frame()).to_dict()
+
+    async def states(self, reuse=True):
+        """ Frames until the game finishes, decoded as by recv_array (or
+        recv_frame, without reuse).
+        """
+        while True:
+            if reuse:
+                frame = await self.recv_array()
+            else:
+                frame = await self.recv_frame()
+            if frame.state == 'finished':
+                break
+            yield frame
+
+    def conflate(self):
+        """ Start keeping only the newest message (see latest()), read by a
+        task on the running loop.
+        """
+        if self.reader is not None:
+            return self
+        self.newest = None  # (msg_filter, message, receive time)
+        self.fresh = False  # newest not yet taken by latest()
+        self.received = 0
+        self.dropped = 0  # messages replaced before anyone took them
+        self.arrived = asyncio.Event()
+        self.reader = asyncio.ensure_future(self._read())
+        return self
+
+    async def _read(self):
+        while True:
+            msg_filter_b, msg_b = await self.sock.recv_multipart(copy=False)
+            recv_time = time.time()
+            msg_filter = msg_filter_b.bytes.decode()
+            decoder = self.decoder(msg_filter)
+            if decoder is None:
+                continue
+            if msg_b.buffer[:4] == TABLE:
+                decoder.decode(msg_b.buffer)  # needed by later states
+                continue
+            self.received += 1
+            if self.fresh:
+                self.dropped += 1
+            self.newest = (msg_filter, msg_b, recv_time)
+            self.fresh = True
+            self.arrived.set()
+
+    async def latest(self, wait=True, timeout=None, out=None):
+        """ The newest state and its age, as StateClient.latest(). """
+        if self.reader is None:
+            raise RuntimeError('latest() needs conflate() first')
+        use_buffer = out is None
+        if use_buffer:
+            out = self.ships
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            if wait and not self.fresh or self.newest is None:
+                self.arrived.clear()
+                remaining = None if deadline is None else \
+                    deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None, None
+                continue
+            msg_filter, msg_b, recv_time = self.newest
+            self.fresh = False
+            frame = self.decoders[msg_filter].decode(msg_b.buffer, out)
+            if frame is not None:
+                break
+            wait = True  # a state from before its table, skip it
+        if use_buffer:
+            self._keep(frame)
+        return frame, time.time() - recv_time
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        self.sock.close()
+
+
+make_random_control = lambda: (random.choice([1, 1, 1, 1, 0]),
+                               random.choice([-1, 1, 0, 0, 0, 0, 0]))
+
+
+async def race(game, game_name, passwords):
+    """ Drive some ships in one game until it finishes. """
+    frames = 0
+    state = game.state_client(game_name)
+    try:
+        async for frame in state.states():
+            if frame.state != 'running':
+                continue
+            frames += 1
+            for password in passwords:
+                await game.control.send(password, *make_random_control())
+    finally:
+        state.close()
+    logger.info('Game "{}" finished after {} frames'.format(game_name,
+                                                            frames))
+
+
+async def main(args):
+    async with AsyncClient(args.hostname, args.lobby_port, args.control_port,
+                           args.state_port) as game:
+        team = make_random_name(10)
+        ships = ['{}{}'.format(args.name, i) for i in range(args.num_ships)]
+        responses = await asyncio.gather(*[
+            game.lobby.register(ship, team, 'password-' + ship)
+            for ship in ships])
+
+        passwords = collections.defaultdict(list)
+        for ship, response in zip(ships, responses):
+            if response.get('status') == 'error':
+                logger.warning('{}: {}'.format(ship, response['message']))
+                continue
+            passwords[response.game].append('password-' + ship)
+        await asyncio.gather(*[race(game, name, p)
+                               for name, p in passwords.items()])
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format='%(asctime)s [%(levelname)s]: %(message)s'
+    )
+
+    parser = ArgumentParser(
+        description='Spacerace: asyncio Dummy Spacecraft'
+    )
+
+    parser.add_argument('--hostname', type=str, help='Server hostname',
+                        default=DEFAULTS['hostname'])
+    parser.add_argument('--state_port', type=int, help='State port',
+                        default=DEFAULTS['state_port'])
+    parser.add_argument('--control_port', type=int, help='Control port',
+                        default=DEFAULTS['control_port'])
+    parser.add_argument('--lobby_port', type=int, help='Lobby port',
+                        default=DEFAULTS['lobby_port'])
+    parser.add_argument('--name', '-n', type=str,
+                        default=make_random_name(6), help='Ship name prefix')
+    parser.add_argument('--num_ships', type=int, default=1,
+                        help='Number of ships to race')
+
+    args = parser.parse_args()
+    logger.debug(args)
+    asyncio.run(main(args))
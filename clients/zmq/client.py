@@ -13,8 +13,12 @@ import logging
 import string
 import random
 import json
+import threading
+import time
 import zmq
 
+from codec import BINARY_PREFIX, DECODERS, TABLE, topic
+
 
 DEFAULTS = {
     'hostname': '127.0.0.1',
@@ -116,17 +120,85 @@ class ControlClient(BaseClient):
 
 
 class StateClient(BaseClient):
+    """ Subscriber to game states, in the 'json' encoding the server
+    publishes or the 'binary' one (codec.py) from a state_relay.py.
+
+    After conflate() a background thread drains the socket and keeps only
+    the newest message, which latest() (and the recv methods) decode on
+    demand, so a slow client always acts on the freshest state.
+    """
+
+    encoding = 'json'
+    reader = None
 
     def make_socket(self):
+        self.decoders = {}
+        self.ships = None
         return self.context.socket(zmq.SUB)
 
-    def subscribe(self, game_name):
-        self.sock.setsockopt_string(zmq.SUBSCRIBE, game_name)
+    def subscribe(self, game_name, encoding='json'):
+        if encoding not in DECODERS:
+            raise ValueError('Unknown state encoding "{}"'.format(encoding))
+        self.encoding = encoding
+        msg_filter = topic(game_name, encoding)
+        if self.reader is None:
+            self.sock.setsockopt_string(zmq.SUBSCRIBE, msg_filter)
+        else:
+            with self.cond:
+                self.pending.append(msg_filter)  # the reader owns the socket
         return self
 
+    def decoder(self, msg_filter):
+        """ The decoder for a topic, or None if it is in the other encoding
+        (matched by a '' subscription).
+        """
+        binary = msg_filter.startswith(BINARY_PREFIX)
+        if binary != (self.encoding == 'binary'):
+            return None
+        if msg_filter not in self.decoders:
+            self.decoders[msg_filter] = DECODERS[self.encoding]()
+        return self.decoders[msg_filter]
+
+    def recv_frame(self, out=None):
+        """ The next state as a codec.Frame, running frames decoded into a
+        structured array (out, if it has a row per ship).
+        """
+        if self.reader is not None:
+            return self.latest(out=out)[0]
+        while True:
+            msg_filter_b, msg_b = self.sock.recv_multipart(copy=False)
+            decoder = self.decoder(msg_filter_b.bytes.decode())
+            if decoder is None:
+                continue
+            frame = decoder.decode(msg_b.buffer, out)
+            if frame is not None:
+                return frame
+
+    def recv_array(self):
+        """ The next state as a codec.Frame whose ships array is this
+        client's own buffer, refilled in place every call.
+
+        Rows are ordered by ship id, so a ship keeps its row from frame to
+        frame until the fleet changes (the buffer is reallocated only if its
+        size does). Copy anything that must outlive the next call.
+        """
+        frame = self.recv_frame(self.ships)
+        self._keep(frame)
+        return frame
+
+    def _keep(self, frame):
+        if frame.ships is not None and frame.ships is not self.ships:
+            if not frame.ships.flags.owndata:
+                frame.ships = frame.ships.copy()  # a view of the message
+            self.ships = frame.ships
+
     def recv(self):
-        msg_filter_b, msg_b = self.sock.recv_multipart()
-        return json.loads(msg_b.decode())
+        if self.encoding != 'json' or self.reader is not None:
+            return self.recv_frame().to_dict()
+        while True:
+            msg_filter_b, msg_b = self.sock.recv_multipart()
+            if not msg_filter_b.startswith(BINARY_PREFIX.encode()):
+                return json.loads(msg_b.decode())
 
     def state_gen(self):
         while True:
@@ -134,3 +206,99 @@ class StateClient(BaseClient):
             if state_data['state'] == 'finished':
                 break
             yield state_data
+
+    def conflate(self):
+        """ Start keeping only the newest message (see latest()).
+
+        ZMQ_CONFLATE would do this in the socket, but it does not support
+        the multipart messages the server publishes, hence the thread.
+        """
+        if self.reader is not None:
+            return self
+        self.cond = threading.Condition()
+        self.pending = []
+        self.newest = None  # (msg_filter, message, receive time)
+        self.fresh = False  # newest not yet taken by latest()
+        self.received = 0
+        self.dropped = 0  # messages replaced before anyone took them
+        self.running = True
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        return self
+
+    def _read(self):
+        poller = zmq.Poller()
+        poller.register(self.sock, zmq.POLLIN)
+        while self.running:
+            with self.cond:
+                for msg_filter in self.pending:
+                    self.sock.setsockopt_string(zmq.SUBSCRIBE, msg_filter)
+                self.pending = []
+            if not poller.poll(100):
+                continue
+            while True:
+                try:
+                    msg_filter_b, msg_b = self.sock.recv_multipart(
+                        zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                recv_time = time.time()
+                msg_filter = msg_filter_b.bytes.decode()
+                with self.cond:
+                    decoder = self.decoder(msg_filter)
+                    if decoder is None:
+                        continue
+                    if msg_b.buffer[:4] == TABLE:
+                        decoder.decode(msg_b.buffer)  # needed by later states
+                        continue
+                    self.received += 1
+                    if self.fresh:
+                        self.dropped += 1
+                    self.newest = (msg_filter, msg_b, recv_time)
+                    self.fresh = True
+                    self.cond.notify_all()
+
+    def latest(self, wait=True, timeout=None, out=None):
+        """ The newest state and its age.
+
+        Args:
+            wait - block for a state newer than the last one returned,
+                rather than returning the last one again
+            timeout - seconds to wait, after which (None, None) is returned
+            out - array to decode into, as in recv_frame (default: this
+                client's buffer, as in recv_array)
+
+        Returns:
+            frame - codec.Frame
+            age - seconds since the frame arrived
+        """
+        if self.reader is None:
+            raise RuntimeError('latest() needs conflate() first')
+        use_buffer = out is None
+        if use_buffer:
+            out = self.ships
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                if wait and not self.fresh or self.newest is None:
+                    remaining = None if deadline is None else \
+                        deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return None, None
+                    self.cond.wait(remaining)
+                    continue
+                msg_filter, msg_b, recv_time = self.newest
+                self.fresh = False
+                frame = self.decoders[msg_filter].decode(msg_b.buffer, out)
+                if frame is not None:
+                    break
+                wait = True  # a state from before its table, skip it
+        if use_buffer:
+            self._keep(frame)
+        return frame, time.time() - recv_time
+
+    def close(self):
+        if self.reader is not None:
+            self.running = False
+            self.reader.join()
+        self.sock.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# codec.py
+#
+# Encodings of the state channel. The server publishes JSON frames like
+#
+#   {"name": "game3", "map": "...", "state": "running",
+#    "data": {"ship": {"x": .., "y": .., "vx": .., "vy": .., "theta": ..,
+#                      "omega": .., "Tl": .., "Tr": ..}, ...}}
+#
+# on topic "<game>". The binary encoding carries the same running frames
+# on topic "bin/<game>" as two kinds of message:
+#
+#   table  b'SRT1', uint32 table id, uint32 ship count,
+#          then JSON {"name", "map", "ids"} - the ship order
+#   state  b'SRS1', uint32 table id, uint32 sequence number,
+#          then one packed little endian float32 record per ship,
+#          fields in STATE_DTYPE order, rows in table order
+#
+# A table is sent whenever the fleet changes and repeated every so often for
+# subscribers who join mid game; state messages that arrive before their
+# table are skipped. Queued and finished messages stay JSON on both topics.
+# Either way a running frame decodes to a NumPy structured array with one
+# row per ship, ordered by ship id.
+
+import json
+import struct
+import numpy as np
+
+FIELDS = ('x', 'y', 'vx', 'vy', 'theta', 'omega', 'Tl', 'Tr')
+STATE_DTYPE = np.dtype([(f, '<f4') for f in FIELDS])
+
+BINARY_PREFIX = 'bin/'
+TABLE = b'SRT1'
+STATE = b'SRS1'
+HEAD = struct.Struct('<4sII')
+
+
+class Frame:
+    """ One decoded state message.
+
+    Running frames carry ids (ship ids, sorted) and ships (structured array
+    of STATE_DTYPE, one row per id); other states have neither.
+    """
+
+    def __init__(self, name, map_name, state, ids=None, ships=None,
+                 seq=None):
+        self.name = name
+        self.map = map_name
+        self.state = state
+        self.ids = ids
+        self.ships = ships
+        self.seq = seq
+
+    def row(self, ship_id):
+        """ The ships record of one ship. """
+        return self.ships[self.ids.index(ship_id)]
+
+    def to_dict(self):
+        """ The frame as the server's JSON would have decoded. """
+        d = dict(state=self.state)
+        if self.name is not None:
+            d['name'] = self.name
+        if self.map is not None:
+            d['map'] = self.map
+        if self.ships is not None:
+            d['data'] = {i: {f: float(row[f]) for f in FIELDS}
+                         for i, row in zip(self.ids, self.ships)}
+        return d
+
+
+def topic(game_name, encoding='json'):
+    """ The subscription topic for a game in an encoding. """
+    return game_name if encoding == 'json' else BINARY_PREFIX + game_name
+
+
+def _reuse(out, n):
+    """ out if it fits n ships, else a new STATE_DTYPE array. """
+    if out is None or len(out) != n:
+        return np.empty(n, STATE_DTYPE)
+    return out
+
+
+def ships_from_data(data, ids, out=None):
+    """ Fill a STATE_DTYPE array (out if it fits) from a JSON frame's data
+    dict.
+    """
+    out = _reuse(out, len(ids))
+    for k, ship in enumerate(ids):
+        d = data[ship]
+        out[k] = tuple(d[f] for f in FIELDS)
+    return out
+
+
+def decode_json(msg_b, out=None):
+    d = json.loads(bytes(msg_b).decode())
+    data = d.get('data')
+    ids = ships = None
+    if data is not None:
+        ids = sorted(data)
+        ships = ships_from_data(data, ids, out)
+    return Frame(d.get('name'), d.get('map'), d.get('state'), ids, ships)
+
+
+class JsonDecoder:
+
+    def decode(self, msg_b, out=None):
+        return decode_json(msg_b, out)
+
+
+class BinaryDecoder:
+    """ Decodes one binary subscription, remembering its ship table. """
+
+    def __init__(self):
+        self.table_id = None
+        self.table = None
+        self.skipped = 0  # state messages that beat their table here
+
+    def decode(self, msg_b, out=None):
+        """ A Frame, or None for table messages and untabled states.
+
+        Running frames' ships are copied into out if it fits, otherwise they
+        are read-only views onto msg_b.
+        """
+        if msg_b[:1] == b'{':
+            return decode_json(msg_b, out)
+        kind, table_id, value = HEAD.unpack_from(msg_b)
+        if kind == TABLE:
+            self.table_id = table_id
+            self.table = json.loads(bytes(msg_b[HEAD.size:]).decode())
+            return None
+        if kind != STATE:
+            raise ValueError('Unknown state message {!r}'.format(kind))
+        if table_id != self.table_id:
+            self.skipped += 1
+            return None
+        ships = np.frombuffer(msg_b, STATE_DTYPE, offset=HEAD.size)
+        if out is not None and len(out) == len(ships):
+            out[...] = ships
+            ships = out
+        return Frame(self.table['name'], self.table['map'], 'running',
+                     self.table['ids'], ships, value)
+
+
+DECODERS = {
+    'json': JsonDecoder,
+    'binary': BinaryDecoder,
+}
+
+
+class BinaryEncoder:
+    """ Turns the server's JSON frames into binary messages (for a relay).
+
+    Args:
+        table_every - repeat the ship table after this many state messages
+    """
+
+    def __init__(self, table_every=30):
+        self.table_every = table_every
+        self.table_id = 0
+        self.key = None
+        self.since_table = 0
+        self.seq = 0
+
+    def encode(self, msg_b):
+        """ The binary messages to publish for one JSON message. """
+        d = json.loads(msg_b.decode())
+        if d.get('state') != 'running':
+            return [msg_b]
+        ids = sorted(d['data'])
+        messages = []
+        key = (d['name'], d['map'], ids)
+        if key != self.key or self.since_table >= self.table_every:
+            if key != self.key:
+                self.table_id += 1
+                self.key = key
+            table = json.dumps(dict(name=d['name'], map=d['map'], ids=ids))
+            messages.append(HEAD.pack(TABLE, self.table_id, len(ids)) +
+                            table.encode())
+            self.since_table = 0
+        ships = ships_from_data(d['data'], ids)
+        messages.append(HEAD.pack(STATE, self.table_id, self.seq) +
+                        ships.tobytes())
+        self.seq += 1
+        self.since_table += 1
+        return messages
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# load_test.py
+#
+# Load generator: ramp up N ships across M processes, each process driving
+# its share of them from one asyncio loop (aio_client.py), and report how the
+# server keeps up:
+#
+#   register    lobby registration round trip
+#   echo        control sent -> the ship's Tl/Tr showing it in a state frame
+#   state lag   frame arrival behind the frame rate fitted to the arrivals,
+#               relative to the earliest frame (queueing in the server,
+#               network, client)
+#   schedule lag
+#               frame arrival behind a steady --fps schedule, the same way;
+#               grows through the run if the server can't keep its rate
+#   frame rate  the fitted rate of each followed game, against --fps, so a
+#               saturated server shows up even though state lag can't see it
+#   loop lag    oversleep of the client's own event loop; when this is large
+#               the load generator, not the server, is the bottleneck
+#
+#   python load_test.py --ships 200 --processes 4 --ramp 20 \
+#       --control_rate 10 --profile random --report load.json
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import time
+import numpy as np
+
+from aio_client import AsyncClient
+from client import DEFAULTS, make_random_name
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+# Controls (linear, rotational) for a ship's n-th send; None sends nothing
+PROFILES = {
+    'random': lambda rng, n: (rng.choice([1, 1, 1, 1, 0]),
+                              rng.choice([-1, 1, 0, 0, 0, 0, 0])),
+    'thrust': lambda rng, n: (1, 0),
+    'flip': lambda rng, n: (1, -1) if n % 2 else (0, 1),
+    'idle': lambda rng, n: None,
+}
+
+
+class Stats:
+    """ One worker's measurements, as plain lists for pickling. """
+
+    def __init__(self):
+        self.register = []
+        self.registered = 0
+        self.register_errors = 0
+        self.echo = []
+        self.state_lag = []
+        self.schedule_lag = []
+        self.frame_rates = []
+        self.loop_lag = []
+        self.controls = 0
+        self.frames = 0
+        self.elapsed = 0.
+
+
+async def drive_ship(game, secret, ship_id, profile, args, rng, state, stats,
+                     stop):
+    """ Send controls at args.control_rate until stop is set. """
+    make_control = PROFILES[profile]
+    period = 1. / args.control_rate
+    n = 0
+    next_send = time.time()
+    while not stop.is_set():
+        control = make_control(rng, n)
+        n += 1
+        if control is not None:
+            sent = time.time()
+            await game.control.send(secret, *control)
+            stats.controls += 1
+            if state.get(ship_id) != control and ship_id not in state[None]:
+                state[None][ship_id] = (control, sent)
+        next_send += period
+        delay = next_send - time.time()
+        if delay < 0:
+            next_send = time.time()  # fell behind, don't burst to catch up
+        await asyncio.sleep(max(delay, 0))
+
+
+async def follow_game(game, game_name, state, args, stats, stop):
+    """ Receive a game's frames, timing arrivals and control echoes. """
+    client = game.state_client(game_name)
+    arrivals = []
+    try:
+        async for frame in client.states():
+            now = time.time()
+            if frame.state != 'running':
+                continue
+            arrivals.append(now)
+            stats.frames += 1
+            pending = state[None]
+            for ship_id, row in zip(frame.ids, frame.ships):
+                shown = (int(row['Tl']), int(row['Tr']))
+                state[ship_id] = shown
+                if ship_id in pending and pending[ship_id][0] == shown:
+                    stats.echo.append(now - pending.pop(ship_id)[1])
+            if stop.is_set():
+                break
+    finally:
+        client.close()
+        if len(arrivals) > 1:
+            # Fit the schedule (start and period) for the jitter, and keep
+            # the fitted rate and the lag against --fps to show saturation
+            arrivals = np.array(arrivals)
+            ticks = np.arange(len(arrivals))
+            period, start = np.polyfit(ticks, arrivals, 1)
+            stats.frame_rates.append(1. / period)
+            behind = arrivals - (start + period * ticks)
+            stats.state_lag.extend((behind - behind.min()).tolist())
+            behind = arrivals - ticks / args.fps
+            stats.schedule_lag.extend((behind - behind.min()).tolist())
+
+
+async def watch_loop(stats, stop, period=0.01):
+    while not stop.is_set():
+        start = time.time()
+        await asyncio.sleep(period)
+        stats.loop_lag.append(time.time() - start - period)
+
+
+async def run_worker(worker, ship_numbers, args, start_time):
+    stats = Stats()
+    stop = asyncio.Event()
+    rng = random.Random(args.seed * 1000 + worker)
+    async with AsyncClient(args.hostname, args.lobby_port, args.control_port,
+                           args.state_port) as game:
+        tasks = [asyncio.ensure_future(watch_loop(stats, stop))]
+        games = {}  # game name -> {ship id: shown control, None: pending}
+
+        async def join(number):
+            name = '{}{}'.format(args.name, number)
+            secret = make_random_name(12)
+            await asyncio.sleep(max(start_time + number * args.ramp /
+                                    args.ships - time.time(), 0))
+            sent = time.time()
+            try:
+                response = await game.lobby.register(name, args.team, secret,
+                                                     timeout=args.timeout)
+            except asyncio.TimeoutError:
+                stats.register_errors += 1
+                return
+            stats.register.append(time.time() - sent)
+            if response.get('status') == 'error':
+                stats.register_errors += 1
+                logger.warning('{}: {}'.format(name, response['message']))
+                return
+            stats.registered += 1
+            if response.game not in games:
+                games[response.game] = {None: {}}
+                tasks.append(asyncio.ensure_future(follow_game(
+                    game, response.game, games[response.game], args, stats,
+                    stop)))
+            tasks.append(asyncio.ensure_future(drive_ship(
+                game, secret, response.name, args.profile, args, rng,
+                games[response.game], stats, stop)))
+
+        await asyncio.gather(*[join(n) for n in ship_numbers])
+        end_time = start_time + args.ramp + args.duration
+        await asyncio.sleep(max(end_time - time.time(), 0))
+        stop.set()
+        stats.elapsed = time.time() - start_time
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+
+def worker_main(worker, ship_numbers, args, start_time):
+    return vars(asyncio.run(run_worker(worker, ship_numbers, args,
+                                       start_time)))
+
+
+def summarise(samples):
+    """ Count, mean, percentiles and max of some latencies (seconds). """
+    if not samples:
+        return dict(count=0)
+    x = np.asarray(samples)
+    out = dict(count=len(x), mean=float(x.mean()), max=float(x.max()))
+    for p in PERCENTILES:
+        out['p{}'.format(p)] = float(np.percentile(x, p))
+    return out
+
+
+def make_report(results, args):
+    merged = {key: [] for key in ('register', 'echo', 'state_lag',
+                                  'schedule_lag', 'loop_lag')}
+    for stats in results:
+        for key in merged:
+            merged[key].extend(stats[key])
+    elapsed = max(stats['elapsed'] for stats in results)
+    rates = [fps for stats in results for fps in stats['frame_rates']]
+    return dict(
+        settings=vars(args),
+        ships=args.ships,
+        registered=sum(stats['registered'] for stats in results),
+        register_errors=sum(stats['register_errors'] for stats in results),
+        controls_sent=sum(stats['controls'] for stats in results),
+        control_rate=sum(stats['controls'] for stats in results) / elapsed,
+        frames_received=sum(stats['frames'] for stats in results),
+        frame_rate=dict(target=args.fps, games=len(rates),
+                        mean=float(np.mean(rates)) if rates else None,
+                        min=float(np.min(rates)) if rates else None),
+        latency={key: summarise(samples) for key, samples in merged.items()},
+    )
+
+
+def print_report(report):
+    print('{} of {} ships registered ({} errors), {} controls sent '
+          '({:.0f}/s), {} frames received'.format(
+              report['registered'], report['ships'],
+              report['register_errors'], report['controls_sent'],
+              report['control_rate'], report['frames_received']))
+    rate = report['frame_rate']
+    if rate['games']:
+        print('Frame rate {:.1f} fps (slowest game {:.1f}) against a target '
+              'of {:.1f}'.format(rate['mean'], rate['min'], rate['target']))
+    print('{:>12} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'ms', 'count', *['p{}'.format(p) for p in PERCENTILES], 'max'))
+    for key, s in report['latency'].items():
+        if s['count']:
+            print('{:>12} {:>8} {:9.2f} {:9.2f} {:9.2f} {:9.2f}'.format(
+                key, s['count'],
+                *[1e3 * s['p{}'.format(p)] for p in PERCENTILES],
+                1e3 * s['max']))
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format='%(asctime)s [%(levelname)s]: %(message)s'
+    )
+
+    parser = ArgumentParser(
+        description='Spacerace: Load Test'
+    )
+
+    parser.add_argument('--hostname', type=str, help='Server hostname',
+                        default=DEFAULTS['hostname'])
+    parser.add_argument('--state_port', type=int, help='State port',
+                        default=DEFAULTS['state_port'])
+    parser.add_argument('--control_port', type=int, help='Control port',
+                        default=DEFAULTS['control_port'])
+    parser.add_argument('--lobby_port', type=int, help='Lobby port',
+                        default=DEFAULTS['lobby_port'])
+    parser.add_argument('--ships', type=int, default=100,
+                        help='Ships to register')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Worker processes to spread them over')
+    parser.add_argument('--ramp', type=float, default=10.,
+                        help='Seconds over which to register the ships')
+    parser.add_argument('--duration', type=float, default=30.,
+                        help='Seconds to keep going after the ramp')
+    parser.add_argument('--control_rate', type=float, default=10.,
+                        help='Controls sent per ship per second')
+    parser.add_argument('--profile', default='random',
+                        choices=sorted(PROFILES))
+    parser.add_argument('--fps', type=float, default=30.,
+                        help='Server frame rate target (simulation.'
+                             'targetFPS), for frame rate and schedule lag')
+    parser.add_argument('--timeout', type=float, default=10.,
+                        help='Lobby registration timeout (seconds)')
+    parser.add_argument('--name', type=str, default='load',
+                        help='Ship name prefix')
+    parser.add_argument('--team', type=str, default='load_test')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', type=str, default=None,
+                        help='JSON file to write the report to')
+
+    args = parser.parse_args()
+    logger.debug(args)
+
+    start_time = time.time() + 1.
+    shares = [list(range(k, args.ships, args.processes))
+              for k in range(args.processes)]
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(worker_main, [(k, share, args, start_time)
+                                             for k, share in enumerate(shares)
+                                             if share])
+
+    report = make_report(results, args)
+    print_report(report)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('Wrote {}'.format(args.report))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# racelog.py
+#
+# Columnar binary race logs: per tick ship states as float32 columns in a
+# file that can be memory mapped and sliced without parsing or copying.
+#
+#   python record_client.py game.srlog --format racelog
+#   python racelog.py game.srlog                 # summary
+#   python racelog.py --from-jsonl game.jsonl game.srlog
+#
+# File layout (little endian):
+#
+#   magic        8 bytes, b'SRLOG1\0\0'
+#   header size  uint64
+#   header       JSON (game, map, ship ids, fields, chunk_ticks), padded
+#                with spaces to a multiple of 64 bytes
+#   chunks       one after another, each holding chunk_ticks ticks:
+#                  count   int64, ticks used, padded to 64 bytes
+#                  tick    int64[chunk_ticks]   frame number
+#                  time    float64[chunk_ticks] receive time (unix seconds)
+#                  x ... Tr  float32[chunk_ticks, ships], one block a field
+#
+# Chunks are all the same size, so a field's block sits at a fixed stride
+# through the file and the reader hands out (chunks, chunk_ticks, ships)
+# views onto the mapping. Values are as broadcast: positions and velocities
+# in pixels. The last chunk is rewritten in place every flush_every ticks as
+# it fills, so a log cut short keeps everything up to its last flush.
+
+import json
+import os
+import numpy as np
+
+MAGIC = b'SRLOG1\0\0'
+FIELDS = ('x', 'y', 'vx', 'vy', 'theta', 'omega', 'Tl', 'Tr')
+ALIGN = 64
+
+
+def _pad(size):
+    return -size % ALIGN
+
+
+class Layout:
+    """ Byte offsets of everything in a chunk. """
+
+    def __init__(self, chunk_ticks, n_ships):
+        self.chunk_ticks = chunk_ticks
+        self.n_ships = n_ships
+        self.tick = ALIGN
+        self.time = self.tick + 8 * chunk_ticks
+        self.fields = self.time + 8 * chunk_ticks
+        self.field_bytes = 4 * chunk_ticks * n_ships
+        self.chunk_bytes = self.fields + len(FIELDS) * self.field_bytes
+
+
+def frame_values(frame, ids):
+    """ (fields, ships) float32 from a broadcast frame, ships in ids order. """
+    data = frame['data']
+    return np.array([[data[i][f] for i in ids] for f in FIELDS], np.float32)
+
+
+class RaceLogWriter:
+    """ Append ticks of one game to a new log file.
+
+    Args:
+        filename - file to create
+        ids - ship ids, in the column order to store them
+        game, map_name - recorded in the header
+        chunk_ticks - ticks per chunk
+        flush_every - ticks between rewrites of the partly filled chunk
+                      (None to write chunks only once full)
+    """
+
+    def __init__(self, filename, ids, game='', map_name='', chunk_ticks=256,
+                 flush_every=32):
+        self.ids = list(ids)
+        self.flush_every = flush_every
+        self.layout = Layout(chunk_ticks, len(self.ids))
+        header = json.dumps(dict(game=game, map=map_name, ids=self.ids,
+                                 fields=FIELDS, chunk_ticks=chunk_ticks))
+        header = header.encode()
+        header += b' ' * _pad(len(MAGIC) + 8 + len(header))
+        self.f = open(filename, 'wb')
+        self.f.write(MAGIC)
+        self.f.write(np.uint64(len(header)).tobytes())
+        self.f.write(header)
+        self.data_start = self.f.tell()
+
+        self.chunk = 0
+        self.count = 0
+        self.ticks = 0
+        self.tick = np.zeros(chunk_ticks, '<i8')
+        self.time = np.zeros(chunk_ticks, '<f8')
+        self.values = np.zeros((len(FIELDS), chunk_ticks, len(self.ids)),
+                               '<f4')
+
+    def append(self, values, time, tick=None):
+        """ Add one tick of (fields, ships) values. """
+        row = self.count
+        self.tick[row] = self.ticks if tick is None else tick
+        self.time[row] = time
+        self.values[:, row] = values
+        self.count += 1
+        self.ticks += 1
+        if self.count == self.layout.chunk_ticks:
+            self.flush()
+            self.chunk += 1
+            self.count = 0
+            self.values[:] = 0
+        elif self.flush_every and self.count % self.flush_every == 0:
+            self.flush()
+
+    def append_frame(self, frame, time, tick=None):
+        self.append(frame_values(frame, self.ids), time, tick)
+
+    def flush(self):
+        """ Write the current chunk (full or not) to its place in the file. """
+        if self.count == 0:
+            return
+        self.f.seek(self.data_start + self.chunk * self.layout.chunk_bytes)
+        count = np.zeros(ALIGN // 8, '<i8')
+        count[0] = self.count
+        self.f.write(count.tobytes())
+        self.f.write(self.tick.tobytes())
+        self.f.write(self.time.tobytes())
+        self.f.write(self.values.tobytes())
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RaceLog:
+    """ Read-only, memory mapped view of a log file.
+
+    Columns are (chunks, chunk_ticks, ships) views; rows past n_ticks in the
+    last chunk are padding. Indexing by tick goes through self.index, the
+    in-memory tick -> row table built when the file is opened.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a race log'.format(filename))
+            size = int(np.frombuffer(f.read(8), '<u8')[0])
+            self.header = json.loads(f.read(size).decode())
+        self.ids = self.header['ids']
+        self.game = self.header['game']
+        self.map = self.header['map']
+        self.layout = layout = Layout(self.header['chunk_ticks'],
+                                      len(self.ids))
+        data_start = len(MAGIC) + 8 + size
+        n_chunks = (os.path.getsize(filename) - data_start) // \
+            layout.chunk_bytes
+        self.mm = np.memmap(filename, np.uint8, 'r') if n_chunks else None
+
+        view = lambda dtype, offset, shape, strides: np.ndarray(
+            shape, dtype, self.mm, data_start + offset, strides)
+        C, n, stride = layout.chunk_ticks, layout.n_ships, layout.chunk_bytes
+        if n_chunks:
+            counts = view('<i8', 0, (n_chunks,), (stride,))
+            self.tick = view('<i8', layout.tick, (n_chunks, C), (stride, 8))
+            self.time = view('<f8', layout.time, (n_chunks, C), (stride, 8))
+            self.columns = {
+                name: view('<f4', layout.fields + k * layout.field_bytes,
+                           (n_chunks, C, n), (stride, 4 * n, 4))
+                for k, name in enumerate(FIELDS)}
+        else:
+            counts = np.zeros(0, '<i8')
+            self.tick = np.zeros((0, C), '<i8')
+            self.time = np.zeros((0, C), '<f8')
+            self.columns = {name: np.zeros((0, C, n), '<f4')
+                            for name in FIELDS}
+        self.counts = np.asarray(counts)
+
+        # Tick index: (chunk, row) of every stored tick, in file order
+        used = np.arange(C) < self.counts[:, np.newaxis]
+        self.chunk_of, self.row_of = np.nonzero(used)
+        self.index = np.asarray(self.tick)[used]
+        self.n_ticks = len(self.index)
+
+    def column(self, name):
+        """ (chunks, chunk_ticks, ships) view of one field. """
+        return self.columns[name]
+
+    def locate(self, tick):
+        """ (chunk, row) of a tick number. """
+        k = np.searchsorted(self.index, tick)
+        if k == self.n_ticks or self.index[k] != tick:
+            raise KeyError('Tick {} is not in the log'.format(tick))
+        return self.chunk_of[k], self.row_of[k]
+
+    def at(self, tick):
+        """ {field: (ships,) view} for one tick. """
+        chunk, row = self.locate(tick)
+        return {name: col[chunk, row] for name, col in self.columns.items()}
+
+    def chunk(self, k):
+        """ {field: (ticks, ships) view} of the used rows of chunk k, plus
+        'tick' and 'time'.
+        """
+        count = self.counts[k]
+        out = {name: col[k, :count] for name, col in self.columns.items()}
+        out['tick'] = self.tick[k, :count]
+        out['time'] = self.time[k, :count]
+        return out
+
+    def series(self, name, start=None, stop=None):
+        """ (ticks, ships) array of one field over the stored ticks between
+        start and stop (tick numbers). A view when they share a chunk.
+        """
+        lo = 0 if start is None else np.searchsorted(self.index, start)
+        hi = self.n_ticks if stop is None else np.searchsorted(self.index,
+                                                               stop)
+        if hi <= lo:
+            return np.zeros((0, self.layout.n_ships), '<f4')
+        col = self.columns[name]
+        first, last = self.chunk_of[lo], self.chunk_of[hi - 1]
+        if first == last:
+            return col[first, self.row_of[lo]:self.row_of[hi - 1] + 1]
+        return col[self.chunk_of[lo:hi], self.row_of[lo:hi]]
+
+    def ship(self, ship_id):
+        """ Column index of a ship id. """
+        return self.ids.index(ship_id)
+
+
+def convert_jsonl(src, dst, chunk_ticks=256):
+    """ Re-pack a JSON lines frame log (record_client.py's default). """
+    writer = None
+    with open(src) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            frame = json.loads(line)
+            if frame.get('state') != 'running':
+                continue
+            if writer is None:
+                game = frame['name']
+                writer = RaceLogWriter(dst, sorted(frame['data']), game,
+                                       frame.get('map', ''), chunk_ticks,
+                                       flush_every=None)
+            if frame['name'] == game:
+                writer.append_frame(frame, 0.)  # no receive times in JSON
+    if writer is not None:
+        writer.close()
+    return writer
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Spacerace: race log summary')
+    parser.add_argument('log', help='Race log (or JSON lines with '
+                                    '--from-jsonl)')
+    parser.add_argument('output', nargs='?', help='Race log to write')
+    parser.add_argument('--from-jsonl', action='store_true',
+                        help='Convert a JSON lines frame log')
+    args = parser.parse_args()
+
+    filename = args.log
+    if args.from_jsonl:
+        convert_jsonl(args.log, args.output)
+        filename = args.output
+
+    log = RaceLog(filename)
+    print('{} on {}: {} ships, {} ticks in {} chunks'.format(
+        log.game, log.map, len(log.ids), log.n_ticks, len(log.counts)))
+    if log.n_ticks > 1:
+        x, y = log.series('x'), log.series('y')
+        travelled = np.sqrt(np.diff(x, axis=0)**2 +
+                            np.diff(y, axis=0)**2).sum(axis=0)
+        thrusting = log.series('Tl').mean(axis=0)
+        for i in np.argsort(-travelled):
+            print('{:>20} {:10.1f} px travelled, thrusting {:4.0%}'.format(
+                log.ids[i], travelled[i], thrusting[i]))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# record_client.py
+#
+# Write every state frame of a game to disk: as JSON lines, for replaying
+# through the Python physics (physics/golden.py), or as a columnar race log
+# for analysis (racelog.py).
+
+import json
+import logging
+import time
+
+from client import DEFAULTS, make_context, make_address
+from racelog import RaceLogWriter
+from argparse import ArgumentParser
+
+import zmq
+
+logging.basicConfig(
+    level=logging.INFO,
+    datefmt='%I:%M:%S %p',
+    format='%(asctime)s [%(levelname)s]: %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JsonLines:
+    """ Frames as received, one per line. """
+
+    def __init__(self, filename):
+        self.f = open(filename, 'w')
+
+    def write(self, raw, frame, recv_time):
+        self.f.write(raw + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+class RaceLogFile:
+    """ Frames packed into a racelog.RaceLogWriter. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.writer = None
+
+    def write(self, raw, frame, recv_time):
+        if self.writer is None:
+            self.writer = RaceLogWriter(self.filename, sorted(frame['data']),
+                                        frame['name'], frame.get('map', ''))
+        self.writer.append_frame(frame, recv_time)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+FORMATS = {
+    'jsonl': JsonLines,
+    'racelog': RaceLogFile,
+}
+
+
+def record(sock, sink, game=None):
+    """ Copy one game's running frames from a SUB socket to sink, until it
+    finishes.
+
+    With no game given, follow the first game seen running. Returns the
+    game name and number of frames written.
+    """
+    frames = 0
+    while True:
+        topic_b, msg_b = sock.recv_multipart()
+        recv_time = time.time()
+        topic = topic_b.decode()
+        raw = msg_b.decode()
+        state = json.loads(raw)
+        if game is None and state.get('state') == 'running':
+            game = topic
+            logger.info('Recording "{}" on map "{}"'.format(
+                game, state.get('map')))
+        if topic != game:
+            continue
+        if state.get('state') == 'finished':
+            break
+        if state.get('state') == 'running':
+            sink.write(raw, state, recv_time)
+            frames += 1
+    return game, frames
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(
+        description='Spacerace: Record Client'
+    )
+
+    parser.add_argument('output', help='File to write')
+    parser.add_argument('--format', default='jsonl', choices=sorted(FORMATS))
+    parser.add_argument('--game', type=str, default=None,
+                        help='Game to record (default: the next one running)')
+    parser.add_argument('--hostname', type=str, help='Server hostname',
+                        default=DEFAULTS['hostname'])
+    parser.add_argument('--state_port', type=int, help='State port',
+                        default=DEFAULTS['state_port'])
+
+    args = parser.parse_args()
+    logger.debug(args)
+
+    context = make_context()
+    sock = context.socket(zmq.SUB)
+    sock.setsockopt_string(zmq.SUBSCRIBE, args.game or '')
+    sock.connect(make_address(args.hostname, args.state_port))
+
+    sink = FORMATS[args.format](args.output)
+    try:
+        game, frames = record(sock, sink, args.game)
+    finally:
+        sink.close()
+    logger.info('Wrote {} frames of "{}" to {}'.format(frames, game,
+                                                       args.output))
+    sock.close()
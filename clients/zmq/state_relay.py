@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# state_relay.py
+#
+# Republish the server's state channel with the binary encoding alongside
+# the JSON (see codec.py), for clients to subscribe to instead of the server:
+#
+#   python state_relay.py --port 5566
+#   client.StateClient('localhost', 5566).subscribe('game3', 'binary')
+
+import logging
+
+from client import DEFAULTS, make_context, make_address
+from codec import BinaryEncoder, topic
+from argparse import ArgumentParser
+
+import zmq
+
+logging.basicConfig(
+    level=logging.INFO,
+    datefmt='%I:%M:%S %p',
+    format='%(asctime)s [%(levelname)s]: %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+
+def relay(sub, pub, table_every=30):
+    """ Forward every message from sub to pub, with binary copies. """
+    encoders = {}
+    while True:
+        game_b, msg_b = sub.recv_multipart()
+        game = game_b.decode()
+        pub.send_multipart([game_b, msg_b])
+        if game not in encoders:
+            encoders[game] = BinaryEncoder(table_every)
+        binary = topic(game, 'binary').encode()
+        for payload in encoders[game].encode(msg_b):
+            pub.send_multipart([binary, payload])
+        if msg_b == b'{"state":"finished"}':
+            del encoders[game]
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(
+        description='Spacerace: State Relay'
+    )
+
+    parser.add_argument('--hostname', type=str, help='Server hostname',
+                        default=DEFAULTS['hostname'])
+    parser.add_argument('--state_port', type=int, help='Server state port',
+                        default=DEFAULTS['state_port'])
+    parser.add_argument('--port', type=int, default=5566,
+                        help='Port to publish on')
+    parser.add_argument('--table_every', type=int, default=30,
+                        help='Frames between repeats of the ship table')
+
+    args = parser.parse_args()
+    logger.debug(args)
+
+    context = make_context()
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt_string(zmq.SUBSCRIBE, '')
+    sub.connect(make_address(args.hostname, args.state_port))
+    pub = context.socket(zmq.PUB)
+    pub.bind('tcp://*:{}'.format(args.port))
+    logger.info('Relaying {} on port {}'.format(
+        make_address(args.hostname, args.state_port), args.port))
+    relay(sub, pub, args.table_every)
@@ -1,11 +1,12 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from helpers import (make_random_name, make_context, make_address,
                      make_control_str, InvalidUsage)
+from lobby import LobbyPool, LobbyTimeout
+from state_cache import StateCache
 from flask.ext.cors import CORS
 from pprint import pformat
 
 import threading
-import json
 import zmq
 
 app = Flask(__name__)
@@ -18,11 +19,13 @@ app.config.from_object('settings')
 # is whether the context can be shared.
 context = make_context()
 
-lobby_sock = context.socket(zmq.REQ)
-addr = make_address(app.config.get('SPACERACE_SERVER'),
-                    app.config.get('SPACERACE_LOBBY_PORT'))
-app.logger.info('Connecting to lobby "{}"...'.format(addr))
-lobby_sock.connect(addr)
+# Lobby sockets are pooled per process and created on demand
+lobby_pool = LobbyPool(app.config.get('SPACERACE_SERVER'),
+                       app.config.get('SPACERACE_LOBBY_PORT'),
+                       timeout=app.config.get('SPACERACE_LOBBY_TIMEOUT'),
+                       retries=app.config.get('SPACERACE_LOBBY_RETRIES'),
+                       size=app.config.get('SPACERACE_LOBBY_POOL'))
+app.logger.info('Using lobby "{}"'.format(lobby_pool.address))
 
 control_sock = context.socket(zmq.PUSH)
 addr = make_address(app.config.get('SPACERACE_SERVER'),
@@ -37,9 +40,14 @@ addr = make_address(app.config.get('SPACERACE_SERVER'),
 app.logger.info('Connecting to state "{}"...'.format(addr))
 state_sock.connect(addr)
 
-# This state gets written to in the main loop
-state_lock = threading.Lock()
-states_dict = {}
+# Latest frame of each game as published, written to by the watcher thread
+state_cache = StateCache()
+
+# Seconds a long poll waits by default and at most, and between SSE comments
+# that keep idle streams open through proxies
+LONG_POLL_TIMEOUT = 25
+LONG_POLL_MAX = 60
+STREAM_KEEPALIVE = 15
 
 
 def state_watcher():
@@ -48,10 +56,8 @@ def state_watcher():
         game_name = game_name_b.decode()
 
         try:
-            latest_state = json.loads(state_b.decode())
-            with state_lock:
-                states_dict[game_name] = latest_state
-        except:
+            state_cache.update(game_name, state_b)
+        except ValueError:
             app.logger.warning('Could not parse game state "{}"'
                                .format(state_b.decode()))
             continue
@@ -62,6 +68,14 @@ t.daemon = True  # die with main thread
 t.start()
 
 
+def cached_response(raw, etag):
+    """ JSON bytes served as they are, 304 if the client has them. """
+    response = Response(raw, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['X-Frame-Id'] = etag
+    return response.make_conditional(request)
+
+
 @app.errorhandler(InvalidUsage)
 def handle_invalid_usage(error):
     response = jsonify(error.to_dict())
@@ -86,12 +100,12 @@ def lobby():
         raise InvalidUsage('Password required')
 
     app.logger.debug('Registering "{}" under team "{}"'.format(name, team))
-    lobby_sock.send_json(dict(name=name, team=team, password=password))
-
-    app.logger.debug('Awaiting response from lobby...')
-    # TODO: Need to set timeout for ZMQ socket here so the HTTP API server
-    # doesn't just die if the socket is blocking
-    response = lobby_sock.recv_json()
+    try:
+        response = lobby_pool.register(name, team, password)
+    except LobbyTimeout as e:
+        app.logger.warning(str(e))
+        raise InvalidUsage('Lobby is not responding, try again.',
+                           status_code=504)
 
     return jsonify(response)
 
@@ -99,10 +113,15 @@ def lobby():
 @app.route('/games')
 def games():
 
-    with state_lock:
-        statuses = {game: states_dict[game]['state'] for game in states_dict}
+    summary, etag = state_cache.games()
+    return cached_response(summary, etag)
 
-    return jsonify(statuses)
+
+def int_arg(name, default=None):
+    try:
+        return int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        raise InvalidUsage('{} must be an integer.'.format(name))
 
 
 @app.route('/state')
@@ -115,13 +134,58 @@ def state(game=None):
     except KeyError:
         raise InvalidUsage('Game not specified.')
 
-    with state_lock:
-        try:
-            current_state = states_dict[game]
-        except KeyError:
-            raise InvalidUsage("Game '{}' does not exist!".format(game))
+    # Long poll: ?after=<X-Frame-Id of the last frame seen> holds the
+    # request until a newer frame arrives, or answers 204 after ?timeout.
+    # Frame ids are content hashes, so any worker can answer the next poll
+    if 'after' in request.args:
+        after = request.args['after']
+        timeout = min(int_arg('timeout', LONG_POLL_TIMEOUT), LONG_POLL_MAX)
+        entry = state_cache.wait(game, after, timeout)
+        if entry is None and state_cache.get(game) is not None:
+            return Response(status=204)
+    else:
+        entry = state_cache.get(game)
+    if entry is None:
+        raise InvalidUsage("Game '{}' does not exist!".format(game))
+
+    # ?ships=a,b filters the frame down to those ships, which means decoding
+    ships = request.args.get('ships')
+    if ships is None:
+        return cached_response(entry.raw, entry.etag)
+
+    current_state = dict(entry.decode())
+    data = current_state.get('data', {})
+    current_state['data'] = {ship: data[ship] for ship in ships.split(',')
+                             if ship in data}
+    response = jsonify(current_state)
+    response.headers['X-Frame-Id'] = entry.etag
+    return response
+
 
-    return jsonify(current_state)
+@app.route('/state/<string:game>/stream')
+def stream(game):
+    """ Server-Sent Events: every new frame of the game, as published, until
+    it finishes. Event ids are frame ids (X-Frame-Id), so a reconnecting
+    EventSource carries on from its Last-Event-ID, whichever worker it
+    reaches.
+    """
+    after = request.headers.get('Last-Event-ID')
+
+    def events(after):
+        while True:
+            entry = state_cache.wait(game, after, STREAM_KEEPALIVE)
+            if entry is None:
+                yield b': keep-alive\n\n'
+                continue
+            after = entry.etag
+            yield b'id: ' + entry.etag.encode() + b'\ndata: ' + \
+                entry.raw + b'\n\n'
+            if entry.state == 'finished':
+                break
+
+    return Response(events(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
 
 
 @app.route('/control', methods=['POST', 'PUT'])
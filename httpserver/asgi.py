@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# asgi.py
+# asyncio entry point for the HTTP bridge: the routes of app.py as a bare
+# ASGI application on zmq.asyncio sockets, for any ASGI server
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5001
+#
+# One coroutine receives every state frame into the same StateCache as
+# app.py and wakes everything waiting on that game (long polls, event
+# streams) by resolving a single shared future. An open connection costs a
+# coroutine rather than a worker thread.
+#
+# /play is a WebSocket for playing over one connection. The client's first
+# message is JSON: {"password", "game"} for a ship this bridge has already
+# registered (through /lobby or /play), or {"name", "team", "password"} to
+# register through the lobby. The reply is the lobby response (or just
+# {"game"}). If the lobby turns the ship away, its error is sent on and the
+# socket closes with code 4409. A {"password", "game"} pair the bridge
+# never registered closes it with 4403. After that:
+#
+#   up    controls as text "<linear>,<rotation>" (e.g. "1,-1"), or as two
+#         bytes (int8 linear, int8 rotation)
+#   down  the game's frames as published (text JSON). A slow reader skips
+#         to the newest frame instead of queueing old ones. The socket
+#         closes after the game's finished message.
+#
+
+import asyncio
+import json
+import logging
+import struct
+import zmq
+import zmq.asyncio
+
+from urllib.parse import parse_qs
+
+import settings
+from helpers import make_address, make_random_name, make_control_str, \
+    InvalidUsage
+from lobby import AsyncLobbyPool, LobbyTimeout
+from state_cache import StateCache
+
+logger = logging.getLogger(__name__)
+
+# As in app.py
+LONG_POLL_TIMEOUT = 25
+LONG_POLL_MAX = 60
+STREAM_KEEPALIVE = 15
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+# WebSocket close code when the lobby refuses a registration
+LOBBY_REFUSED = 4409
+# ... and when a {"password", "game"} hello names a ship we didn't register
+SHIP_UNKNOWN = 4403
+
+CONTROL = struct.Struct('<bb')
+LINEAR = (0, 1)
+ROTATION = (-1, 0, 1)
+
+
+class Fanout:
+    """ Wakes every coroutine waiting on a game when its next frame lands,
+    with one future per game however many are waiting.
+    """
+
+    def __init__(self):
+        self.futures = {}
+
+    def publish(self, game):
+        future = self.futures.pop(game, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def next(self, game, timeout=None):
+        """ Wait for the game's next frame; asyncio.TimeoutError if it does
+        not come within timeout seconds.
+        """
+        future = self.futures.get(game)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.futures[game] = future
+        # shielded: one waiter timing out must not cancel it for the rest
+        await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+class Request:
+
+    def __init__(self, scope, body=b''):
+        self.scope = scope
+        self.method = scope.get('method', 'GET')
+        self.path = scope['path']
+        self.args = {k: v[-1] for k, v in
+                     parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {k.decode().lower(): v.decode()
+                        for k, v in scope.get('headers', [])}
+        self.body = body
+
+    @property
+    def json(self):
+        try:
+            msg = json.loads(self.body.decode())
+        except ValueError:
+            msg = None
+        if not isinstance(msg, dict):
+            raise InvalidUsage('Request body must be a JSON object.')
+        return msg
+
+    def int_arg(self, name, default=None):
+        try:
+            return int(self.args.get(name, default))
+        except (TypeError, ValueError):
+            raise InvalidUsage('{} must be an integer.'.format(name))
+
+
+class Response:
+
+    def __init__(self, body=b'', status=200,
+                 content_type=b'application/json', headers=()):
+        self.body = body
+        self.status = status
+        self.headers = [(b'content-type', content_type)] + list(headers)
+
+    async def send(self, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self.headers + CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def jsonify(status=200, **obj):
+    return Response(json.dumps(obj).encode(), status)
+
+
+def parse_control(message):
+    """ (linear, rotation) from a /play control message, or None. """
+    try:
+        if message.get('bytes') is not None:
+            linear, rotation = CONTROL.unpack(message['bytes'])
+        else:
+            linear, rotation = map(int, message.get('text', '').split(','))
+    except (struct.error, ValueError):
+        return None
+    if linear not in LINEAR or rotation not in ROTATION:
+        return None
+    return linear, rotation
+
+
+def etag_matches(request, etag):
+    tags = [t.strip() for t in
+            request.headers.get('if-none-match', '').split(',')]
+    tags = [(t[2:] if t.startswith('W/') else t).strip('"') for t in tags]
+    return etag in tags or '*' in tags
+
+
+def cached_response(request, raw, etag):
+    """ JSON bytes served as they are, 304 if the client has them. """
+    headers = [(b'etag', '"{}"'.format(etag).encode()),
+               (b'x-frame-id', etag.encode())]
+    if etag_matches(request, etag):
+        return Response(status=304, headers=headers)
+    return Response(raw, headers=headers)
+
+
+class Bridge:
+    """ The ASGI application. Sockets and the state watcher start with the
+    server's lifespan events, or on the first request if it sends none.
+    """
+
+    def __init__(self, config=settings):
+        self.config = config
+        self.state_cache = StateCache()
+        self.fanout = Fanout()
+        self.ships = {}  # password -> game, for ships registered through us
+        self.started = False
+        self.routes = [
+            ('GET', ('',), self.greeting),
+            ('POST', ('lobby',), self.lobby),
+            ('GET', ('games',), self.games),
+            ('GET', ('state',), self.state),
+            ('GET', ('state', None), self.state),
+            ('GET', ('state', None, 'stream'), self.stream),
+            ('POST', ('control',), self.control),
+            ('PUT', ('control',), self.control),
+        ]
+
+    def start(self):
+        config = self.config
+        self.context = zmq.asyncio.Context()
+        self.context.linger = 0
+        self.lobby_pool = AsyncLobbyPool(
+            config.SPACERACE_SERVER, config.SPACERACE_LOBBY_PORT,
+            timeout=config.SPACERACE_LOBBY_TIMEOUT,
+            retries=config.SPACERACE_LOBBY_RETRIES,
+            size=config.SPACERACE_LOBBY_POOL)
+
+        self.control_sock = self.context.socket(zmq.PUSH)
+        self.control_sock.connect(make_address(
+            config.SPACERACE_SERVER, config.SPACERACE_CONTROL_PORT))
+
+        self.state_sock = self.context.socket(zmq.SUB)
+        self.state_sock.setsockopt_string(zmq.SUBSCRIBE, '')
+        self.state_sock.connect(make_address(
+            config.SPACERACE_SERVER, config.SPACERACE_STATE_PORT))
+        self.watcher = asyncio.ensure_future(self.state_watcher())
+        self.started = True
+
+    def stop(self):
+        if self.started:
+            self.watcher.cancel()
+            self.lobby_pool.close()
+            self.context.destroy()
+            self.started = False
+
+    async def state_watcher(self):
+        while True:
+            game_name_b, state_b = await self.state_sock.recv_multipart()
+            game_name = game_name_b.decode()
+            try:
+                entry = self.state_cache.update(game_name, state_b)
+            except ValueError:
+                logger.warning('Could not parse game state "{}"'
+                               .format(state_b.decode()))
+                continue
+            if entry.state == 'finished':
+                self.ships = {password: game for password, game in
+                              self.ships.items() if game != game_name}
+            self.fanout.publish(game_name)
+
+    async def register(self, name, team, password):
+        """ Lobby registration that remembers which game each accepted
+        password went to, for websocket()'s {"password", "game"} hello.
+        """
+        response = await self.lobby_pool.register(name, team, password)
+        if response.get('status') != 'error' and 'game' in response:
+            self.ships[password] = response['game']
+        return response
+
+    async def wait(self, game, after, timeout):
+        """ As StateCache.wait, without blocking the loop. """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        since = self.state_cache.current(game)
+        while True:
+            entry = self.state_cache.newer(game, after, since)
+            if entry is not None:
+                return entry
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await self.fanout.next(game, remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if not self.started:
+            self.start()
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self.websocket(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def route(self, method, path):
+        parts = tuple(path.strip('/').split('/'))
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            if len(pattern) != len(parts) or \
+                    any(p is not None and p != part
+                        for p, part in zip(pattern, parts)):
+                continue
+            if route_method == method:
+                params = [part for p, part in zip(pattern, parts) if p is None]
+                return handler, params
+            allowed = True
+        if allowed:
+            raise InvalidUsage('Method not allowed.', status_code=405)
+        raise InvalidUsage('Not found.', status_code=404)
+
+    async def http(self, scope, receive, send):
+        if scope['method'] == 'OPTIONS':  # CORS preflight
+            await Response(status=204, headers=[
+                (b'access-control-allow-methods', b'GET, POST, PUT'),
+                (b'access-control-allow-headers', b'Content-Type'),
+            ]).send(send)
+            return
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        request = Request(scope, body)
+        try:
+            handler, params = self.route(request.method, request.path)
+            response = await handler(request, *params)
+        except InvalidUsage as error:
+            response = Response(json.dumps(error.to_dict()).encode(),
+                                error.status_code)
+        if callable(response):
+            await response(receive, send)  # streaming
+        else:
+            await response.send(send)
+
+    async def greeting(self, request):
+        return jsonify(msg='Welcome to spacerace!')
+
+    async def lobby(self, request):
+        msg = request.json
+        name = msg.get('name', make_random_name())
+        team = msg.get('team', make_random_name())
+        try:
+            password = msg['password']
+        except KeyError:
+            raise InvalidUsage('Password required')
+
+        logger.debug('Registering "{}" under team "{}"'.format(name, team))
+        try:
+            response = await self.register(name, team, password)
+        except LobbyTimeout as e:
+            logger.warning(str(e))
+            raise InvalidUsage('Lobby is not responding, try again.',
+                               status_code=504)
+        return Response(json.dumps(response).encode())
+
+    async def games(self, request):
+        summary, etag = self.state_cache.games()
+        return cached_response(request, summary, etag)
+
+    async def state(self, request, game=None):
+        try:
+            if game is None:
+                game = request.args['game']
+        except KeyError:
+            raise InvalidUsage('Game not specified.')
+
+        if 'after' in request.args:
+            after = request.args['after']
+            timeout = min(request.int_arg('timeout', LONG_POLL_TIMEOUT),
+                          LONG_POLL_MAX)
+            entry = await self.wait(game, after, timeout)
+            if entry is None and self.state_cache.get(game) is not None:
+                return Response(status=204)
+        else:
+            entry = self.state_cache.get(game)
+        if entry is None:
+            raise InvalidUsage("Game '{}' does not exist!".format(game))
+
+        ships = request.args.get('ships')
+        if ships is None:
+            return cached_response(request, entry.raw, entry.etag)
+
+        current_state = dict(entry.decode())
+        data = current_state.get('data', {})
+        current_state['data'] = {ship: data[ship] for ship in ships.split(',')
+                                 if ship in data}
+        return Response(json.dumps(current_state).encode(), headers=[
+            (b'x-frame-id', entry.etag.encode())])
+
+    async def stream(self, request, game):
+        after = request.headers.get('last-event-id')
+
+        async def events(receive, send):
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'),
+                                    (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')] +
+                        CORS_HEADERS})
+            disconnected = asyncio.ensure_future(receive())
+            last = after
+            try:
+                while True:
+                    waiting = asyncio.ensure_future(
+                        self.wait(game, last, STREAM_KEEPALIVE))
+                    await asyncio.wait([waiting, disconnected],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected.done():
+                        waiting.cancel()
+                        return
+                    entry = waiting.result()
+                    if entry is None:
+                        chunk = b': keep-alive\n\n'
+                    else:
+                        last = entry.etag
+                        chunk = b'id: ' + last.encode() + b'\ndata: ' + \
+                            entry.raw + b'\n\n'
+                    finished = entry is not None and entry.state == 'finished'
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': not finished})
+                    if finished:
+                        return
+            finally:
+                disconnected.cancel()
+
+        return events
+
+    async def control(self, request):
+        msg = request.json
+        try:
+            password = str(msg['password'])
+            linear = str(msg['linear'])
+            rotation = str(msg['rotation'])
+        except KeyError:
+            raise InvalidUsage('One or more required arguments not provided.')
+
+        control_str = make_control_str(password, linear, rotation)
+        logger.debug('Sending control message "{0}"'.format(control_str))
+        await self.control_sock.send_string(control_str)
+        return jsonify(message='Sent control message "{0}"'.format(
+            control_str))
+
+    async def websocket(self, scope, receive, send):
+        """ /play: a ship's controls in, its game's states out.
+
+        A {"password", "game"} hello is only taken for a password this
+        bridge registered into that game and hasn't seen finish, so a
+        socket can't pick up a ship it never registered. Anything else has
+        to go through the lobby first.
+        """
+        message = await receive()  # websocket.connect
+        if scope['path'].strip('/') != 'play':
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def close(code, error=None):
+            if error is not None:
+                await send({'type': 'websocket.send', 'text': json.dumps(
+                    dict(status='error', message=error))})
+            await send({'type': 'websocket.close', 'code': code})
+
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        try:
+            hello = json.loads(message.get('text') or message['bytes'])
+            password = str(hello['password'])
+            if 'game' in hello:
+                response = dict(game=hello['game'])
+                known = self.ships.get(password) == response['game']
+            else:
+                known = True
+                response = await self.register(
+                    hello.get('name', make_random_name()),
+                    hello.get('team', make_random_name()), password)
+        except (KeyError, TypeError, ValueError):
+            await close(1008, 'Start with {"password", "game"} or '
+                              '{"name", "team", "password"}')
+            return
+        except LobbyTimeout:
+            await close(1013, 'Lobby is not responding, try again.')
+            return
+        if not known:
+            await close(SHIP_UNKNOWN, 'No ship registered here with that '
+                        'password in that game. Register with {"name", '
+                        '"team", "password"} instead.')
+            return
+        if response.get('status') == 'error':
+            await close(LOBBY_REFUSED, response.get('message',
+                                                    'Registration refused'))
+            return
+        game = response['game']
+        await send({'type': 'websocket.send', 'text': json.dumps(response)})
+
+        async def send_states():
+            last = None
+            while True:
+                entry = await self.wait(game, last, STREAM_KEEPALIVE)
+                if entry is None:
+                    continue
+                last = entry.etag
+                await send({'type': 'websocket.send',
+                            'text': entry.raw.decode()})
+                if entry.state == 'finished':
+                    await send({'type': 'websocket.close', 'code': 1000})
+                    return
+
+        sender = asyncio.ensure_future(send_states())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                control = parse_control(message)
+                if control is None:
+                    await send({'type': 'websocket.send', 'text': json.dumps(
+                        dict(status='error', message='Controls are '
+                             '"<0|1>,<-1|0|1>"'))})
+                    continue
+                await self.control_sock.send_string(make_control_str(
+                    password, *map(str, control)))
+        finally:
+            sender.cancel()
+
+
+app = Bridge()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# lobby.py
+# Pooled bridge from HTTP request handlers to the game server's lobby.
+#
+# Each registration checks a DEALER socket out of the pool, so concurrent
+# requests go to the lobby in parallel instead of queueing on one REQ
+# socket. A socket only ever has one request outstanding, which is how
+# replies are matched to requests. If a reply is late, the socket is thrown
+# away rather than returned to the pool, so the stray reply can never be
+# read by a later request. The pool belongs to the process that made it.
+# After a fork (gunicorn --preload, multiprocessing) the child starts a
+# fresh context and sockets of its own. AsyncLobbyPool is the same on
+# zmq.asyncio sockets, for asgi.py.
+#
+
+import json
+import os
+import threading
+import zmq
+import zmq.asyncio
+
+from helpers import make_address, make_context
+
+
+class LobbyTimeout(Exception):
+    pass
+
+
+class LobbyPool:
+    """ Thread-safe pool of lobby sockets.
+
+    Args:
+        hostname, port - the lobby socket
+        timeout - seconds to wait for each reply
+        retries - further attempts after a timeout, each on a new socket
+        size - idle sockets to keep for reuse
+    """
+
+    def __init__(self, hostname, port, timeout=5., retries=1, size=8):
+        self.address = make_address(hostname, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.size = size
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _reset(self):
+        # Called with the lock held: sockets inherited over a fork belong to
+        # the parent's context, so leave them alone and start again
+        self.pid = os.getpid()
+        self.context = self.new_context()
+        self.idle = []
+
+    def new_context(self):
+        return make_context()
+
+    def _checkout(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            if self.idle:
+                return self.idle.pop()
+            context = self.context
+        sock = context.socket(zmq.DEALER)
+        sock.connect(self.address)
+        return sock
+
+    def _checkin(self, sock):
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append(sock)
+                return
+        sock.close()
+
+    def request(self, msg):
+        """ Send one JSON message and return the decoded reply.
+
+        Raises LobbyTimeout if no reply arrives in any attempt. A retried
+        registration whose first reply was lost may come back as an
+        "already added" error from the lobby.
+        """
+        payload = json.dumps(msg).encode()
+        for attempt in range(self.attempts):
+            sock = self._checkout()
+            try:
+                sock.send_multipart([b'', payload])
+                if sock.poll(1000 * self.timeout, zmq.POLLIN):
+                    empty, reply_b = sock.recv_multipart()
+                    self._checkin(sock)
+                    return json.loads(reply_b.decode())
+            except zmq.ZMQError:
+                pass
+            sock.close()  # its reply may still turn up, so never reuse it
+        raise self.timed_out()
+
+    @property
+    def attempts(self):
+        return self.retries + 1
+
+    def timed_out(self):
+        return LobbyTimeout('No reply from lobby at {} after {} attempt(s)'
+                            .format(self.address, self.attempts))
+
+    def register(self, name, team, password):
+        return self.request(dict(name=name, team=team, password=password))
+
+    def close(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                for sock in self.idle:
+                    sock.close()
+                self.context.term()
+            self.pid = None
+
+
+class AsyncLobbyPool(LobbyPool):
+    """ LobbyPool whose request() and register() are coroutines. """
+
+    def new_context(self):
+        context = zmq.asyncio.Context()
+        context.linger = 0
+        return context
+
+    async def request(self, msg):
+        payload = json.dumps(msg).encode()
+        for attempt in range(self.attempts):
+            sock = self._checkout()
+            try:
+                await sock.send_multipart([b'', payload])
+                if await sock.poll(1000 * self.timeout, zmq.POLLIN):
+                    empty, reply_b = await sock.recv_multipart()
+                    self._checkin(sock)
+                    return json.loads(reply_b.decode())
+            except zmq.ZMQError:
+                pass
+            sock.close()
+        raise self.timed_out()
+
+    async def register(self, name, team, password):
+        return await self.request(dict(name=name, team=team,
+                                       password=password))
@@ -8,3 +8,9 @@ SPACERACE_SERVER = os.environ.get('SPACERACE_SERVER', 'server')
 SPACERACE_STATE_PORT = config['stateSocket'].get('port', 5556)
 SPACERACE_CONTROL_PORT = config['controlSocket'].get('port', 5557)
 SPACERACE_LOBBY_PORT = config['lobbySocket'].get('port', 5558)
+
+# Lobby bridge: seconds to wait for each reply, retries after a timeout and
+# idle sockets kept per process (see lobby.py)
+SPACERACE_LOBBY_TIMEOUT = float(os.environ.get('SPACERACE_LOBBY_TIMEOUT', 5))
+SPACERACE_LOBBY_RETRIES = int(os.environ.get('SPACERACE_LOBBY_RETRIES', 1))
+SPACERACE_LOBBY_POOL = int(os.environ.get('SPACERACE_LOBBY_POOL', 8))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# state_cache.py
+# Latest published state of each game, kept as the bytes the server sent.
+#
+# /state responses are those bytes verbatim, so a frame is never parsed or
+# re-serialised no matter how many bots poll it. ETags are hashes of those
+# bytes, so every worker process hands out the same tag for the same frame,
+# and they double as frame ids for long polls and event streams. The frame
+# is only decoded when a filtered view asks for it, and then once. The
+# /games summary is rebuilt only when some game changes state.
+#
+# Long-poll and streaming requests wait() on the cache's condition variable,
+# which the state watcher signals with every frame. A client can be
+# answered by a different worker each time, so "newer than frame id X" is
+# judged against the ids of the last few frames this process has seen: a
+# recent X gets the latest frame at once, an X it never saw (a frame it
+# hasn't received yet, or one from before a restart) waits for its next one.
+#
+
+import collections
+import hashlib
+import json
+import re
+import threading
+
+# The server's JSON has sorted keys, so "state" comes last, after the ship
+# data (whose values are objects, never strings)
+STATE_RE = re.compile(rb'"state"\s*:\s*"([^"]*)"')
+
+# Frame ids remembered per game for wait(), a couple of seconds' worth
+RECENT = 64
+
+
+class Entry:
+
+    def __init__(self, raw, state, etag):
+        self.raw = raw
+        self.state = state
+        self.etag = etag
+        self.decoded = None
+
+    def decode(self):
+        if self.decoded is None:
+            self.decoded = json.loads(self.raw.decode())
+        return self.decoded
+
+
+def content_tag(raw):
+    """ ETag for some bytes: the same in every process that has them. """
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def frame_state(raw):
+    """ The "state" of a published frame, without decoding all of it. """
+    matches = STATE_RE.findall(raw[-64:]) or STATE_RE.findall(raw)
+    if matches:
+        return matches[-1].decode()
+    state = json.loads(raw.decode()).get('state')
+    if not isinstance(state, str):
+        raise ValueError('Frame has no state')
+    return state
+
+
+class StateCache:
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.entries = {}
+        self.recent = {}  # game -> ids (ETags) of its last RECENT frames
+        self.summary = b'{}'
+        self.summary_etag = content_tag(self.summary)
+
+    def update(self, game, raw):
+        """ Store a newly published frame, returning its Entry.
+
+        Raises ValueError (from json) if the frame has no readable state.
+        """
+        state = frame_state(raw)
+        entry = Entry(raw, state, content_tag(raw))
+        with self.cond:
+            last = self.entries.get(game)
+            self.entries[game] = entry
+            if last is None:
+                self.recent[game] = collections.deque(maxlen=RECENT)
+            self.recent[game].append(entry.etag)
+            if last is None or last.state != state:
+                self.summary = json.dumps({g: e.state for g, e in
+                                           sorted(self.entries.items())}
+                                          ).encode()
+                self.summary_etag = content_tag(self.summary)
+            self.cond.notify_all()
+        return entry
+
+    def get(self, game):
+        """ The game's latest Entry, or None. """
+        with self.cond:
+            return self.entries.get(game)
+
+    def current(self, game):
+        """ Id of the game's latest frame, or None. """
+        entry = self.get(game)
+        return None if entry is None else entry.etag
+
+    def newer(self, game, after, since):
+        """ The game's latest Entry if it is newer than frame id after, else
+        None. since is current() from when the caller started waiting.
+
+        An after this process doesn't remember counts as older only once the
+        game has moved on from since (or finished), so a worker that is a
+        frame behind another doesn't hand back a frame the client has had.
+        """
+        entry = self.entries.get(game)
+        if entry is None or entry.etag == after:
+            return None
+        if after is None or after in self.recent[game] or \
+                entry.etag != since or entry.state == 'finished':
+            return entry
+
+    def wait(self, game, after=None, timeout=None):
+        """ The game's latest Entry once it is newer than frame id after
+        (any frame, if after is None), or None if none turns up within
+        timeout seconds.
+        """
+        with self.cond:
+            since = self.current(game)
+            return self.cond.wait_for(lambda: self.newer(game, after, since),
+                                      timeout)
+
+    def games(self):
+        """ (summary JSON bytes, ETag). """
+        with self.cond:
+            return self.summary, self.summary_etag
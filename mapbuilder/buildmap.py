@@ -14,7 +14,7 @@ import numpy as np
 import matplotlib.pyplot as pl
 
 from scipy.misc import imread, imsave
-from scipy.ndimage.filters import gaussian_filter
+from scipy.ndimage.filters import gaussian_filter, minimum_filter
 
 
 @click.command()
@@ -81,6 +81,14 @@ def buildmap(image, mapname, settingsfile, visualise):
 
     dny, dnx = norm_layer(*np.gradient(blurmap))
 
+    # Calculate contact-free cells
+    print("Calculating safe cells...")
+    world = settings['simulation']['world']
+    clearance = (settings['simulation']['ship']['radius'] +
+                 settings['mapbuilder']['safeMargin']) * world['mapScale']
+    safemap = safe_cells(distmap, clearance,
+                         settings['mapbuilder']['safeCellPixels'])
+
     # plotting
     if visualise:
         print("Making plots...")
@@ -148,6 +156,7 @@ def buildmap(image, mapname, settingsfile, visualise):
     save_float32_map(mapname+'_wnormy', dny, vec=True)
     save_float32_map(mapname+'_flowx', dfx)
     save_float32_map(mapname+'_flowy', dfy, vec=True)
+    save_bool_map(mapname+'_safe', safemap)
 
     # Easy to read formats for players
     print('\t- csv layers')
@@ -176,6 +185,24 @@ def norm_layer(y, x):
     return y, x
 
 
+def safe_cells(distmap, clearance, cellsize):
+    """ Blocks of cellsize pixels that are further than clearance pixels
+    from any wall, returned at full resolution.
+
+    Each pixel's neighbours are included, since bilinear interpolation
+    anywhere in a pixel reads the next pixel along too.
+    """
+    h, w = distmap.shape
+    closest = minimum_filter(distmap, size=3, mode='nearest')
+    ph, pw = -h % cellsize, -w % cellsize
+    closest = np.pad(closest, ((0, ph), (0, pw)), 'edge')
+    blocks = closest.reshape(closest.shape[0] // cellsize, cellsize,
+                             closest.shape[1] // cellsize, cellsize)
+    safe = blocks.min(axis=(1, 3)) > clearance
+    safe = np.repeat(np.repeat(safe, cellsize, axis=0), cellsize, axis=1)
+    return safe[:h, :w]
+
+
 def save_bool_map(filename, boolmap):
     np.save(filename, np.flipud(boolmap.astype(bool)))
 
@@ -0,0 +1,97 @@
+""" Run many independent races on one map in lockstep.
+
+The batch is stored as a (worlds, ships, 6) state tensor. Each step flattens
+it into one big fleet, labels every ship with its world, and takes one
+integrator step for the whole fleet. The broadphase only pairs ships that
+share a label, so the worlds never see each other.
+"""
+import numpy as np
+
+from engine import integrate
+
+
+def world_labels(n_worlds, n_ships):
+    """ Length n_worlds*n_ships world index of each flattened ship. """
+    return np.repeat(np.arange(n_worlds), n_ships)
+
+
+def broadcast_props(props, n_worlds):
+    """ Ship properties as (worlds, ships, 4), sharing a per-ship table. """
+    props = np.asarray(props, dtype=float)
+    if props.ndim == 2:
+        props = np.broadcast_to(props, (n_worlds,) + props.shape)
+    return props
+
+
+def integrate_worlds(states, props, inp, walls, bounds, dt, worlds=None,
+                     method='rk4', safe=None):
+    """ Advance every world by one step, in place.
+    Args:
+        states - (worlds, ships, 6) float array, updated in place
+        props - (ships, 4) shared by all worlds, or (worlds, ships, 4)
+        inp - (worlds, ships, 2) thrust force and torque
+        walls, bounds - the map, as for engine.integrate
+        dt - time step
+        worlds - optional precomputed world_labels() to save rebuilding
+                 them every step
+        method - integrator name, see engine.METHODS
+        safe - optional contact-free pixel mask, see engine.physics
+    """
+    n_worlds, n_ships, n_states = states.shape
+    if worlds is None:
+        worlds = world_labels(n_worlds, n_ships)
+    flat = states.reshape(-1, n_states)  # a view, so updates land in states
+    flat_props = broadcast_props(props, n_worlds).reshape(-1, 4)
+    flat_inp = np.asarray(inp, dtype=float).reshape(-1, 2)
+    integrate(flat, flat_props, flat_inp, walls, bounds, dt, worlds, method,
+              safe)
+
+
+class Batch:
+    """ A batch of races on one map with a fixed fleet size.
+
+    Args:
+        states0 - (worlds, ships, 6) initial states (copied)
+        props - (ships, 4) or (worlds, ships, 4) ship properties
+        walls, bounds - the map, as for engine.integrate
+        dt - time step
+        method - integrator name, see engine.METHODS
+        safe - optional contact-free pixel mask, see engine.physics
+    """
+
+    def __init__(self, states0, props, walls, bounds, dt, method='rk4',
+                 safe=None):
+        self.states = np.array(states0, dtype=float)
+        if not self.states.flags.c_contiguous:
+            self.states = np.ascontiguousarray(self.states)
+        n_worlds, n_ships, _ = self.states.shape
+        self.props = broadcast_props(props, n_worlds)
+        self.walls = walls
+        self.bounds = bounds
+        self.dt = dt
+        self.method = method
+        self.safe = safe
+        self.t = 0.
+        self.worlds = world_labels(n_worlds, n_ships)
+
+    @property
+    def shape(self):
+        return self.states.shape[:2]
+
+    def step(self, inp):
+        """ Advance all worlds by dt under (worlds, ships, 2) inputs. """
+        integrate_worlds(self.states, self.props, inp, self.walls,
+                         self.bounds, self.dt, self.worlds, self.method,
+                         self.safe)
+        self.t += self.dt
+
+    def run(self, controller, duration):
+        """ Step until duration has elapsed.
+        Args:
+            controller - callable(t, states) -> (worlds, ships, 2) inputs
+            duration - simulated seconds
+        """
+        n_steps = int(round(duration / self.dt))
+        for _ in range(n_steps):
+            self.step(controller(self.t, self.states))
+        return self.states
@@ -0,0 +1,15 @@
+""" Micro-benchmarks for the Python physics engine.
+
+    python -m benchmarks --output before.json
+    python -m benchmarks --baseline before.json   # after an engine change
+
+Run from the physics directory. Each benchmark times one engine entry point
+(broadphase, map interpolation, physics() or a full integrate() step) on a
+fleet of ships, for several fleet sizes, two layouts and one or more maps:
+
+    spread    - ships scattered over the free space of the whole map
+    clustered - ships packed into a spawn box like engine.main's spawn_size
+
+Maps are prefixes of layers built by mapbuilder/buildmap.py (the PNGs in
+maps/ need building first); a synthetic open arena is always available.
+"""
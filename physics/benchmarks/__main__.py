@@ -0,0 +1,69 @@
+import argparse
+import json
+import platform
+import sys
+import numpy as np
+
+from engine import BACKENDS, set_backend
+from .baseline import compare
+from .scenes import LAYOUTS, load_scene
+from .suite import BENCHMARKS, run_suite
+
+
+def print_result(result):
+    print('{benchmark:>26} {map:>12} {layout:>10} {ships:>7} '
+          '{ms:>12.3f}ms'.format(ms=1e3*result['seconds'], **result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spacerace: physics '
+                                     'benchmarks (run from physics/)')
+    parser.add_argument('--maps', nargs='+', default=['arena'],
+                        help="'arena' and/or mapbuilder prefixes")
+    parser.add_argument('--ships', nargs='+', type=int,
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS),
+                        choices=LAYOUTS)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        help='Run just these benchmarks')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--mapscale', type=float, default=10.)
+    parser.add_argument('--backend', default='numpy', choices=BACKENDS)
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON from an earlier --output to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slow-down allowed before flagging a regression')
+    args = parser.parse_args()
+
+    backend = set_backend(args.backend)
+    scenes = [load_scene(name, args.mapscale) for name in args.maps]
+    print('{:>26} {:>12} {:>10} {:>7} {:>14}'.format(
+        'benchmark', 'map', 'layout', 'ships', 'time/call'))
+    results = run_suite(scenes, args.ships, args.layouts, args.only,
+                        args.repeats, print_result)
+
+    if args.output:
+        meta = dict(python=platform.python_version(), numpy=np.__version__,
+                    machine=platform.machine(), backend=backend)
+        with open(args.output, 'w') as f:
+            json.dump(dict(meta=meta, results=results), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows = compare(results, baseline, args.tolerance)
+        print('\nAgainst {} ({:+.0f}% allowed):'.format(args.baseline,
+                                                        100*args.tolerance))
+        for result, old, ratio, regressed in rows:
+            print('{benchmark:>26} {map:>12} {layout:>10} {ships:>7} '
+                  '{old:>9.3f}ms -> {new:>9.3f}ms  {ratio:5.2f}x{flag}'.format(
+                      old=1e3*old, new=1e3*result['seconds'], ratio=ratio,
+                      flag='  REGRESSION' if regressed else '', **result))
+        if any(row[3] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
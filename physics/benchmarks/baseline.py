@@ -0,0 +1,26 @@
+""" Compare a run against a stored one. """
+
+
+def key(result):
+    return (result['benchmark'], result['map'], result['layout'],
+            result['ships'])
+
+
+def compare(results, baseline, tolerance=0.2):
+    """ Match results to baseline entries and flag slow-downs.
+    Args:
+        results, baseline - lists of run_suite() result dicts
+        tolerance - fractional slow-down allowed before it's a regression
+    Returns:
+        list of (result, baseline seconds, ratio, regressed) for every
+        result that the baseline also timed
+    """
+    before = {key(r): r['seconds'] for r in baseline}
+    rows = []
+    for result in results:
+        if key(result) not in before:
+            continue
+        old = before[key(result)]
+        ratio = result['seconds'] / old
+        rows.append((result, old, ratio, ratio > 1. + tolerance))
+    return rows
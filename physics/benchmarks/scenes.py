@@ -0,0 +1,64 @@
+""" Maps and fleets for the benchmarks. """
+import numpy as np
+
+from engine import RaceMap
+from headless import ship_properties
+
+LAYOUTS = ('spread', 'clustered')
+
+# engine.main() packs 30 ships into a 6x6 spawn box
+SPAWN_SHIPS = 30
+SPAWN_SIZE = 6.
+
+
+def arena(width=150., height=100., mapscale=10.):
+    """ A walled, empty rectangle built in memory, in world units. """
+    h, w = int(height * mapscale), int(width * mapscale)
+    rows, cols = np.mgrid[0:h, 0:w].astype(float)
+    # Distance (pixels) to each border, then take the nearest one
+    to_border = np.dstack((cols, w - 1 - cols, rows, h - 1 - rows))
+    nearest = np.argmin(to_border, axis=2)
+    wdist = np.min(to_border, axis=2)
+    normals = np.array([[1., 0.], [-1., 0.], [0., 1.], [0., -1.]])[nearest]
+    walls = np.dstack((wdist / mapscale, normals))
+    occupancy = wdist < 1.
+    start = np.argwhere((np.abs(rows - h/2.) < 20) &
+                        (np.abs(cols - w/2.) < 20))
+    end = np.zeros((h, w), bool)
+    end[:, -2*int(mapscale):] = True
+    enddist = (w - cols) / mapscale
+    return RaceMap('arena', mapscale, walls, occupancy, start, end, enddist)
+
+
+def load_scene(name, mapscale=10.):
+    """ 'arena' or a mapbuilder prefix. """
+    if name == 'arena':
+        return arena(mapscale=mapscale)
+    return RaceMap.load(name, mapscale)
+
+
+def make_fleet(racemap, n, layout, seed=0):
+    """ n*6 states and n*4 properties for n ships.
+    Args:
+        racemap - where to put them
+        n - fleet size
+        layout - 'spread' over all free pixels, or 'clustered' in a spawn
+                 box around the start area at engine.main()'s density
+        seed - fleets are deterministic per (map, n, layout, seed)
+    """
+    rng = np.random.RandomState(seed)
+    states = np.zeros((n, 6))
+    if layout == 'spread':
+        free = np.argwhere(~racemap.occupancy)
+        rows, cols = free[rng.randint(len(free), size=n)].T
+        states[:, 0] = (cols + rng.random_sample(n)) / racemap.mapscale
+        states[:, 1] = (rows + rng.random_sample(n)) / racemap.mapscale
+    elif layout == 'clustered':
+        centre = racemap.start.mean(axis=0)[::-1] / racemap.mapscale
+        half = 0.5 * SPAWN_SIZE * np.sqrt(n / float(SPAWN_SHIPS))
+        states[:, :2] = centre + (2 * rng.random_sample((n, 2)) - 1) * half
+    else:
+        raise ValueError('Unknown layout {!r}'.format(layout))
+    states[:, 2] = rng.random_sample(n) * 2 * np.pi
+    states[:, 3:6] = rng.random_sample((n, 3)) * 2 - 1
+    return states, ship_properties(n)
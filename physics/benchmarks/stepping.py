@@ -0,0 +1,121 @@
+""" How much physics each integrator pays for a simulated second.
+
+    python -m benchmarks.stepping
+
+Counts ship-evaluations of engine.physics() (ships passed in, summed over
+calls) rather than timing, so the numbers don't depend on the machine.
+Each method flies the same fleet under full thrust at each --dt and is set
+against plain RK4 at the server's timeStep. The near_contact() checks
+behind the guard and the substepped integrators aren't counted. Also
+checks that a fleet clear of any contact takes a step longer than
+engine.max_stable_dt() in one go, not as sub-steps.
+"""
+import argparse
+import contextlib
+import numpy as np
+
+import engine
+from engine import INTEGRATORS, METHODS, integrate, max_stable_dt
+from .scenes import LAYOUTS, load_scene, make_fleet
+from .suite import THRUST
+
+SERVER_DT = 0.004  # simulation.timeStep
+
+
+@contextlib.contextmanager
+def count_evaluations():
+    """ Count ship-evaluations of engine.physics() while in the block.
+    Yields a one element list holding the running count.
+    """
+    count = [0]
+    physics = engine.physics
+
+    def counted(states, *args, **kwargs):
+        count[0] += len(states)
+        return physics(states, *args, **kwargs)
+
+    engine.physics = counted
+    try:
+        yield count
+    finally:
+        engine.physics = physics
+
+
+def free_fleet(racemap, n=10, spacing=5.):
+    """ n ships at rest in a row across the middle of the map, spacing
+    apart, and their properties.
+    """
+    xmin, xmax, ymin, ymax = racemap.bounds
+    states = np.zeros((n, 6))
+    states[:, 0] = 0.5 * (xmin + xmax) + spacing * (np.arange(n) - n / 2.)
+    states[:, 1] = 0.5 * (ymin + ymax)
+    props = np.tile([1., 0.25, 1., 1.], (n, 1))
+    return states, props
+
+
+def check_free_flight(racemap, dt=0.04):
+    """ Raise AssertionError unless every stepper takes a contact-free
+    fleet's dt as a single step, guard or no guard.
+    """
+    states, props = free_fleet(racemap)
+    inp = np.tile([1., 0.], (len(states), 1))
+    for method in INTEGRATORS:
+        assert dt > max_stable_dt(props, method), \
+            'dt {} is within the limit, nothing to check'.format(dt)
+        evaluations = []
+        for guard in (True, False):
+            with count_evaluations() as count:
+                integrate(states.copy(), props, inp, racemap.walls,
+                          racemap.bounds, dt, method=method,
+                          safe=racemap.safe, guard=guard)
+            evaluations.append(count[0])
+        assert evaluations[0] == evaluations[1], \
+            '{} sub-stepped a free fleet: {} ship-evaluations, not {}'.format(
+                method, *evaluations)
+
+
+def evaluation_rate(racemap, states, props, dt, method, duration=1.):
+    """ Ship-evaluations per simulated second flying states for duration.
+    """
+    states = states.copy()
+    inp = np.tile(THRUST, (len(states), 1))
+    with count_evaluations() as count:
+        for _ in range(int(round(duration / dt))):
+            integrate(states, props, inp, racemap.walls, racemap.bounds, dt,
+                      method=method, safe=racemap.safe)
+    return count[0] / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spacerace: physics '
+                                     'evaluations per simulated second '
+                                     '(run from physics/)')
+    parser.add_argument('--map', default='arena',
+                        help="'arena' or a mapbuilder prefix")
+    parser.add_argument('--mapscale', type=float, default=10.)
+    parser.add_argument('--ships', type=int, default=30)
+    parser.add_argument('--dt', nargs='+', type=float, default=[0.04, 0.1])
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS),
+                        choices=LAYOUTS)
+    args = parser.parse_args()
+
+    racemap = load_scene(args.map, args.mapscale)
+    check_free_flight(racemap)
+    print('Free flight OK')
+
+    print('{:>10} {:>16} {:>6} {:>14} {:>10}'.format(
+        'layout', 'method', 'dt', 'evals/sim-s', 'vs server'))
+    for layout in args.layouts:
+        states, props = make_fleet(racemap, args.ships, layout)
+        reference = evaluation_rate(racemap, states, props, SERVER_DT, 'rk4')
+        print('{:>10} {:>16} {:>6g} {:>14.0f} {:>9.2f}x'.format(
+            layout, 'rk4', SERVER_DT, reference, 1.))
+        for dt in args.dt:
+            for method in METHODS:
+                rate = evaluation_rate(racemap, states, props, dt, method)
+                print('{:>10} {:>16} {:>6g} {:>14.0f} {:>9.2f}x'.format(
+                    layout, method, dt, rate, rate / reference))
+
+
+if __name__ == '__main__':
+    main()
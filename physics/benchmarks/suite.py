@@ -0,0 +1,78 @@
+""" The benchmarks themselves, and the loop that times them. """
+import timeit
+import numpy as np
+
+from broadphase import shortlist_pairs
+from engine import (integrate, linear_interpolate, old_shortlist_collisions,
+                    physics, shortlist_collisions)
+from .scenes import make_fleet
+
+DT = 0.004  # the server's timeStep, so integrate() takes a single step
+THRUST = (60., 6.)  # linearThrust, rotationalThrust
+
+
+def _inputs(n):
+    return np.tile(THRUST, (n, 1))
+
+
+# Each entry builds the call to time from (racemap, states, props)
+BENCHMARKS = {
+    'shortlist_pairs':
+        lambda rm, s, p: lambda: shortlist_pairs(s[:, :2], 1.),
+    'shortlist_collisions':
+        lambda rm, s, p: lambda: shortlist_collisions(s[:, :2], 1.),
+    'old_shortlist_collisions':
+        lambda rm, s, p: lambda: old_shortlist_collisions(s[:, :2], 1.),
+    'linear_interpolate':
+        lambda rm, s, p: lambda: linear_interpolate(rm.walls, rm.bounds,
+                                                    s[:, :2]),
+    'physics':
+        lambda rm, s, p: lambda: physics(s, p, _inputs(len(s)), rm.walls,
+                                         rm.bounds, safe=rm.safe),
+    'integrate':
+        lambda rm, s, p: lambda: integrate(s.copy(), p, _inputs(len(s)),
+                                           rm.walls, rm.bounds, DT,
+                                           safe=rm.safe),
+}
+
+# The old loops are quadratic-ish; don't wait minutes for them
+MAX_SHIPS = {'old_shortlist_collisions': 1000}
+
+
+def best_time(fn, repeats):
+    """ Best per-call seconds over repeats, each looping for >= 0.2s. """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeats, number)) / number
+
+
+def run_suite(scenes, ship_counts, layouts, names=None, repeats=5,
+              report=None):
+    """ Time every benchmark on every (map, layout, ship count).
+    Args:
+        scenes - RaceMaps to run on
+        ship_counts, layouts - fleet sizes and scenes.LAYOUTS to try
+        names - subset of BENCHMARKS (default: all)
+        repeats - best of this many timing runs
+        report - optional callable(result) for progress
+    Returns:
+        list of result dicts: benchmark, map, layout, ships, seconds
+    """
+    names = sorted(BENCHMARKS) if names is None else names
+    results = []
+    for racemap in scenes:
+        for layout in layouts:
+            for n in ship_counts:
+                states, props = make_fleet(racemap, n, layout)
+                for name in names:
+                    if n > MAX_SHIPS.get(name, n):
+                        continue
+                    fn = BENCHMARKS[name](racemap, states, props)
+                    with np.errstate(all='ignore'):
+                        seconds = best_time(fn, repeats)
+                    result = dict(benchmark=name, map=racemap.name,
+                                  layout=layout, ships=n, seconds=seconds)
+                    results.append(result)
+                    if report is not None:
+                        report(result)
+    return results
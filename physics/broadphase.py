@@ -0,0 +1,61 @@
+""" Sort-based spatial hashing broadphase for the space race physics.
+
+Ships are binned into a uniform grid one diameter wide, so any two ships that
+can touch sit in the same or neighbouring cells. Rather than a dict of cells,
+each ship's cell is packed into a single integer key, the keys are sorted once
+and every neighbour lookup becomes a searchsorted range in that sorted list.
+"""
+import numpy as np
+
+# Half of the 3x3 neighbourhood (plus the home cell) - looking the other way
+# would find every pair twice.
+NEIGHBOURS = np.array([[0, 0], [1, -1], [1, 0], [1, 1], [0, 1]])
+
+
+def shortlist_pairs(P, r, groups=None):
+    """ Find candidate collision pairs with a sorted spatial hash.
+    Args:
+        P - n*2 ship positions
+        r - ship radius (sets the grid size)
+        groups - optional length n integer labels; ships are only paired
+                 with ships carrying the same label
+    Returns:
+        (i, j) - index arrays of unique candidate pairs, i != j
+    """
+    n = P.shape[0]
+    if n < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    grid = r * 2. + 1e-5  # base off diameter
+    cells = np.floor(P / grid).astype(np.int64)
+
+    # Pack (group, cy, cx) into one key, padding a cell on each side so that
+    # neighbour offsets never wrap into another row or group.
+    cells -= cells.min(axis=0) - 1
+    width, height = cells.max(axis=0) + 2
+    key = cells[:, 1] * width + cells[:, 0]
+    if groups is not None:
+        key += np.asarray(groups, dtype=np.int64) * (width * height)
+
+    order = np.argsort(key, kind='mergesort')
+    sorted_key = key[order]
+
+    # For each (ship, neighbour offset) find the run of ships in that cell
+    offsets = NEIGHBOURS[:, 1] * width + NEIGHBOURS[:, 0]
+    query = (sorted_key[:, np.newaxis] + offsets).ravel()
+    lo = np.searchsorted(sorted_key, query, side='left')
+    hi = np.searchsorted(sorted_key, query, side='right')
+
+    # Within the home cell only pair with ships later in sorted order
+    home = np.zeros((n, len(offsets)), dtype=bool)
+    home[:, 0] = True
+    home = home.ravel()
+    me = np.repeat(np.arange(n), len(offsets))
+    lo = np.where(home, np.maximum(lo, me + 1), lo)
+
+    # Expand each [lo, hi) range into explicit pairs without a Python loop
+    counts = np.maximum(hi - lo, 0)
+    total = counts.sum()
+    first = np.repeat(me, counts)
+    starts = np.cumsum(counts) - counts
+    second = np.arange(total) - np.repeat(starts - lo, counts)
+    return order[first], order[second]
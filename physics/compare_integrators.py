@@ -0,0 +1,115 @@
+""" How far do the cheaper integrators drift from RK4?
+
+    python compare_integrators.py ../maps/etd-winter-retreat-2015/bt-circle1
+
+Races are flown once with a random (but seeded) controller while every
+tick's control matrix is recorded. Each integrator then replays the same
+controls from the same start and we report how far its ships wander from
+the RK4 replay, and how much faster it got there.
+"""
+import argparse
+import numpy as np
+from time import time
+
+from engine import METHODS, RaceMap, integrate
+from headless import HeadlessRace, load_settings
+
+
+class Wander:
+    """ Random controls, like the dummy clients, held for hold seconds. """
+
+    def __init__(self, seed, hold=0.5):
+        self.rng = np.random.RandomState(seed)
+        self.hold = hold
+        self.until = -1.
+        self.controls = None
+
+    def __call__(self, t, states):
+        if t >= self.until:
+            n = states.shape[0]
+            linear = self.rng.choice([1, 1, 1, 1, 0], n)
+            rotation = self.rng.choice([-1, 1, 0, 0, 0, 0, 0], n)
+            self.controls = np.vstack((linear, rotation)).T.astype(float)
+            self.until = t + self.hold
+        return self.controls
+
+
+def record_race(racemap, n_ships, settings, dt, duration, seed):
+    """ Fly one race and keep its per-tick inputs.
+    Returns:
+        states0, props, inputs - start states, properties and a
+        (ticks, n, 2) array of the force/torque inputs actually applied
+    """
+    race = HeadlessRace(racemap, n_ships, Wander(seed), settings, dt, seed)
+    states0 = race.states.copy()
+    inputs = []
+    for _ in range(int(round(duration / dt))):
+        inputs.append(race.controller(race.t, race.states) * race.thrust)
+        race.step()
+    return states0, race.props, np.array(inputs)
+
+
+def replay(racemap, states0, props, inputs, dt, method):
+    """ Re-fly recorded inputs; returns (ticks, n, 6) states and run time. """
+    states = states0.copy()
+    trajectory = np.empty((len(inputs),) + states.shape)
+    start = time()
+    for tick, inp in enumerate(inputs):
+        integrate(states, props, inp, racemap.walls, racemap.bounds, dt,
+                  method=method, safe=racemap.safe)
+        trajectory[tick] = states
+    return trajectory, time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Spacerace: integrator divergence from RK4')
+    parser.add_argument('map', help='Map prefix')
+    parser.add_argument('--ships', type=int, default=30)
+    parser.add_argument('--races', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=10.)
+    parser.add_argument('--dt', type=float, default=None,
+                        help='Time step (default: timeStep from settings)')
+    parser.add_argument('--settings', default='../config/spacerace.json')
+    args = parser.parse_args()
+
+    settings = load_settings(args.settings)
+    if args.dt is None:
+        args.dt = settings['simulation']['timeStep']
+    racemap = RaceMap.load(args.map,
+                           settings['simulation']['world']['mapScale'])
+    checkpoints = [t for t in (1., 5., 10., 30., 60.) if t <= args.duration]
+
+    print('{:>16} {:>8} '.format('method', 'speedup') +
+          ' '.join('{:>10}'.format('@{:g}s'.format(t)) for t in checkpoints))
+    divergence = {m: [] for m in METHODS}
+    runtime = {m: 0. for m in METHODS}
+    for seed in range(args.races):
+        states0, props, inputs = record_race(racemap, args.ships, settings,
+                                             args.dt, args.duration, seed)
+        reference, t_ref = replay(racemap, states0, props, inputs, args.dt,
+                                  'rk4')
+        runtime['rk4'] += t_ref
+        for method in METHODS:
+            if method == 'rk4':
+                continue
+            trajectory, t_run = replay(racemap, states0, props, inputs,
+                                       args.dt, method)
+            runtime[method] += t_run
+            # Mean ship position error per tick, world units
+            error = np.sqrt(np.sum((trajectory[:, :, :2] -
+                                    reference[:, :, :2])**2, axis=2))
+            divergence[method].append(error.mean(axis=1))
+
+    for method in METHODS:
+        if method == 'rk4':
+            continue
+        error = np.mean(divergence[method], axis=0)
+        ticks = [int(round(t / args.dt)) - 1 for t in checkpoints]
+        print('{:>16} {:>7.1f}x '.format(method,
+                                         runtime['rk4'] / runtime[method]) +
+              ' '.join('{:>10.3f}'.format(error[k]) for k in ticks))
+
+
+if __name__ == '__main__':
+    main()
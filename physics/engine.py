@@ -1,17 +1,99 @@
 """ Physics test sandbox for the space race game!
     Alistair Reid 2015
 """
-import matplotlib.pyplot as pl
-import matplotlib as mpl
 import numpy as np
 from numpy.linalg import norm
 from time import time, sleep
 import os
+import warnings
+from broadphase import shortlist_pairs
+
+# Physics model parameters (hand tuned to feel right)
+RHO = 0.1  # Air density (or absorb into cd_a?)
+K_ELASTIC = 4000.  # spring normal force
+SPIN_DRAG_RATIO = 1.8  # spin drag to forward drag
+EPS = 1e-5  # avoid divide by zero warnings
+MU = 0.05  # coefficient of friction (tangent force/normal force)
+MU_WALL = 0.01  # wall friction param
+DEEP_WALL = 0.25  # penetration (in radii) before we give up on springs
+WALL_DAMPING = 100.  # velocity damping once that deep into a wall
+
+# physics() backends: the NumPy reference, or the compiled kernels in jit.py
+BACKENDS = ('numpy', 'numba')
+_jit = None  # the jit module while the numba backend is selected
+
+
+def set_backend(name):
+    """ Select the physics() backend for this process.
+    Falls back to numpy (with a warning) when numba isn't installed.
+    Returns:
+        the name of the backend now in use
+    """
+    global _jit
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend {!r}, expected one of {}'.format(
+            name, BACKENDS))
+    _jit = None
+    if name == 'numba':
+        import jit
+        if jit.available():
+            _jit = jit
+        else:
+            warnings.warn('numba is not installed, using the numpy backend')
+    return get_backend()
+
+
+def get_backend():
+    return 'numpy' if _jit is None else 'numba'
 
-def integrate(states, props, inp, walls, bounds, dt):
+
+def integrate(states, props, inp, walls, bounds, dt, worlds=None,
+              method='rk4', safe=None, guard=True):
+    """ Advance states by dt in place with the named integrator.
+
+    A step longer than max_stable_dt() is only safe while no ship is in or
+    near a contact. With guard on, such a step is checked with
+    near_contact() before and after; if anyone could be touching, it is
+    redone as equal sub-steps within the limit. Raises FloatingPointError
+    if the states still end up non-finite.
+    Args:
+        method - one of METHODS: a stepper from INTEGRATORS, or one with
+                 '-substepped' appended to run it through
+                 integrate_substepped()
+        guard - False to take dt in one step regardless, for callers that
+                have already picked out the ships clear of any contact
+    """
+    base, _, mode = method.partition('-')
+    if mode == 'substepped':
+        return integrate_substepped(states, props, inp, walls, bounds, dt,
+                                    worlds=worlds, method=base, safe=safe)
+    if mode or base not in INTEGRATORS:
+        raise ValueError('Unknown integrator {!r}, expected one of {}'.format(
+            method, METHODS))
+    derivs = lambda y: physics(y, props, inp, walls, bounds, worlds, safe)
+    step = INTEGRATORS[method]
+    n_sub = max(int(np.ceil(dt / max_stable_dt(props, method) - 1e-9)), 1)
+    if not guard:
+        n_sub = 1
+    elif n_sub > 1:
+        margin = norm(states[:, 3:5], axis=1) * dt + CONTACT_SLACK
+        if not near_contact(states, props, walls, bounds, margin, worlds,
+                            safe).any():
+            backup = states.copy()
+            step(derivs, states, dt)
+            if not near_contact(states, props, walls, bounds,
+                                np.zeros(len(states)), worlds, safe).any():
+                check_finite(states)
+                return
+            states[:] = backup  # flew into something after all
+    for _ in range(n_sub):
+        step(derivs, states, dt / n_sub)
+    check_finite(states)
+
+
+def rk4_step(derivs, states, dt):
     """ Implementing 4th order Runge-Kutta for a time stationary DE.
     """
-    derivs = lambda y: physics(y, props, inp, walls, bounds)
     k1 = derivs(states)
     k2 = derivs(states + 0.5*k1*dt)
     k3 = derivs(states + 0.5*k2*dt)
@@ -19,7 +101,161 @@ def integrate(states, props, inp, walls, bounds, dt):
     states += (k1 + 2*k2 + 2*k3 + k4)/6. * dt
 
 
-def physics(states, props, inp, walls, bounds):
+def euler_step(derivs, states, dt):
+    """ Semi-implicit (symplectic) Euler - one derivative evaluation.
+    Kick the velocities first, then drift the positions with the new ones.
+    """
+    accel = derivs(states)[:, 3:6]
+    states[:, 3:6] += accel * dt
+    states[:, 0:3] += states[:, 3:6] * dt
+
+
+# Steppers take (derivs, states, dt) and update states in place
+INTEGRATORS = {
+    'rk4': rk4_step,
+    'euler': euler_step,
+}
+
+# Largest omega*dt each stepper stays stable at, for both the damping and
+# the spring (oscillating) modes of a contact
+STABILITY = {
+    'rk4': 2.78,
+    'euler': 2.,
+}
+
+# Extra reach (world units) on top of a ship's travel in a step when
+# deciding whether it could come into contact
+CONTACT_SLACK = 0.25
+
+# Every method integrate() accepts
+METHODS = tuple(INTEGRATORS) + tuple(name + '-substepped'
+                                     for name in INTEGRATORS)
+
+
+def max_stable_dt(props, method='rk4', contacts=4):
+    """ Largest explicit step the stepper can take through a contact.
+
+    Contacts are stiff springs. A ship pressed by contacts others at once
+    sees K_ELASTIC times their centre distance (up to a diameter) from each,
+    halved mass for a pair, and deep in a wall its velocity decays at
+    WALL_DAMPING / mass. The step must keep omega*dt for the fastest of
+    these inside the stepper's STABILITY limit.
+    Args:
+        props - n*4 (mass, inertia, radius, cd_a)
+        method - stepper name from INTEGRATORS
+        contacts - simultaneous contacts allowed for per ship
+    """
+    if len(props) == 0:
+        return np.inf
+    mass = props[:, 0]
+    stiffness = K_ELASTIC * contacts * np.maximum(4. * props[:, 2], 1.)
+    rate = max(np.sqrt(stiffness / mass).max(), (WALL_DAMPING / mass).max())
+    return STABILITY[method] / rate
+
+
+def check_finite(states):
+    """ Raise FloatingPointError naming the ships whose states aren't
+    finite (the integration blew up, usually from too large a step).
+    """
+    bad = ~np.isfinite(states).all(axis=1)
+    if bad.any():
+        raise FloatingPointError(
+            'Non-finite state for ship(s) {} - the time step is too large '
+            'for these contacts'.format(np.flatnonzero(bad).tolist()))
+
+
+def integrate_substepped(states, props, inp, walls, bounds, dt,
+                         contact_dt=None, slack=CONTACT_SLACK, worlds=None,
+                         max_retries=3, method='rk4', safe=None):
+    """ One step of dt that only pays for a small time step where ships
+    are touching. Selected in integrate() as '<method>-substepped'.
+
+    Ships that are in, or could reach, contact with a wall or another ship
+    this step are sub-stepped at contact_dt; everyone else takes a single
+    step of dt, with integrate()'s guard off since they were picked for
+    being clear of contact. Any free ship that ends the step in contact
+    after all is rolled back and the step redone with it sub-stepped too,
+    so nothing penetrates further than a contact_dt step would allow.
+    Args:
+        contact_dt - largest time step used for ships in contact
+                     (default: max_stable_dt() for them)
+        slack - extra reach (world units) added to each ship's travel this
+                step when deciding who is near contact
+        max_retries - rollbacks before giving up and sub-stepping everyone
+        method - stepper from INTEGRATORS used for both the big and the
+                 small steps
+        safe - optional contact-free pixel mask, see physics()
+    Returns:
+        boolean mask of the ships that were sub-stepped
+    """
+    n = states.shape[0]
+    worlds = np.zeros(n, dtype=int) if worlds is None else np.asarray(worlds)
+    margin = norm(states[:, 3:5], axis=1) * dt + slack
+    contact = near_contact(states, props, walls, bounds, margin, worlds,
+                           safe)
+    backup = states.copy()
+
+    for retry in range(max_retries + 1):
+        if retry == max_retries:
+            contact[:] = True
+        free = ~contact
+        if free.any():
+            sub = states[free]
+            integrate(sub, props[free], inp[free], walls, bounds, dt,
+                      worlds[free], method, safe, guard=False)
+            states[free] = sub
+        if contact.any():
+            sub = states[contact]
+            limit = contact_dt or max_stable_dt(props[contact], method)
+            n_sub = max(int(np.ceil(dt / limit - 1e-9)), 1)
+            for _ in range(n_sub):
+                integrate(sub, props[contact], inp[contact], walls, bounds,
+                          dt / n_sub, worlds[contact], method, safe)
+            states[contact] = sub
+
+        # Did any free flyer hit something we didn't see coming?
+        entered = free & near_contact(states, props, walls, bounds,
+                                      np.zeros(n), worlds, safe)
+        if not entered.any():
+            break
+        states[:] = backup
+        contact |= entered
+    return contact
+
+
+def near_contact(states, props, walls, bounds, margin, worlds=None,
+                 safe=None):
+    """ Ships within margin (per ship) of touching a wall or another ship. """
+    P = states[:, :2]
+    rad = props[:, 2]
+    reach = rad + margin
+    close = wall_lookup(walls, bounds, P, safe)[:, 0] < reach
+    i, j = shortlist_pairs(P, np.max(reach, initial=0.), worlds)
+    hit = norm(P[j] - P[i], axis=1) < reach[i] + reach[j]
+    close[i[hit]] = True
+    close[j[hit]] = True
+    return close
+
+
+def physics(states, props, inp, walls, bounds, worlds=None, safe=None):
+    """ State derivatives for every ship.
+    Args:
+        states - n*6 (x, y, th, vx, vy, w)
+        props - n*4 (mass, inertia, radius, cd_a)
+        inp - n*2 (thrust force, torque)
+        walls, bounds - map layers and extent, see linear_interpolate
+        worlds - optional length n labels; ships in different worlds share
+                 the map but never collide with each other
+        safe - optional boolean pixel mask (the map's _safe layer) of
+               places too far from any wall for a ship to touch it
+    Returns:
+        n*6 time derivative of states
+    """
+
+    if _jit is not None:
+        return _jit.physics(states, props, inp, walls, bounds, worlds, safe,
+                            RHO, K_ELASTIC, SPIN_DRAG_RATIO, EPS, MU, MU_WALL,
+                            DEEP_WALL, WALL_DAMPING)
 
     # Unpack state, input and property vectors
     P = states[:, :2]
@@ -31,71 +267,109 @@ def physics(states, props, inp, walls, bounds):
     rad = props[:, 2:3]
     cd_a = props[:, 3:4]  # coeff drag * area
     f = inp[:, :1] * np.hstack((np.cos(Th), np.sin(Th)))
-    trq = inp[:, 1:2]
-    n = P.shape[0]
-
-    # Physics model parameters (hand tuned to feel right)
-    rho = 0.1  # Air density (or absorb into cd_a?)
-    k_elastic = 4000.  # spring normal force
-    spin_drag_ratio = 1.8  # spin drag to forward drag
-    eps = 1e-5  # avoid divide by zero warnings
-    mu = 0.05  # coefficient of friction (tangent force/normal force)
-    mu_wall = 0.01  # wall friction param
-    sigmoid = lambda x: -1 + 2./(1. + np.exp(-x))
+    trq = inp[:, 1:2].copy()  # don't accumulate into the caller's inputs
 
     # Compute drag
-    f -= cd_a * rho * V * norm(V, axis=1)[:, np.newaxis]
-    trq -= spin_drag_ratio*cd_a * rho * W * np.abs(W) * rad**2
+    f -= cd_a * RHO * V * norm(V, axis=1)[:, np.newaxis]
+    trq -= SPIN_DRAG_RATIO*cd_a * RHO * W * np.abs(W) * rad**2
 
     # Inter-ship collisions
-    checks = shortlist_collisions(P, 1.)  # Apply test spatial hashing
-    for i, j in checks:
-        dP = P[j] - P[i]
-        dist = norm(dP) + eps
-        diameter = rad[i] + rad[j]
-        if dist < diameter:
-
-            # Direct collision: linear spring normal force
-            f_magnitude = (diameter-dist)*k_elastic
-            f_norm = f_magnitude * dP
-            f[i] -= f_norm
-            f[j] += f_norm
-
-            # Spin effects (ask Al to draw a free body diagram)
-            perp = np.array([-dP[1], dP[0]])/dist  # surface perpendicular
-            v_rel = rad[i]*W[i] + rad[j]*W[j] + np.dot(V[i] - V[j], perp)
-            fric = f_magnitude * mu * sigmoid(v_rel)
-            f_fric = fric * perp
-            f[i] += f_fric
-            f[j] -= f_fric
-            trq[i] -= fric * rad[i]
-            trq[j] -= fric * rad[j]
+    i, j = shortlist_pairs(P, 1., worlds)  # Apply test spatial hashing
+    f_ships, trq_ships = ship_collisions(P, V, W, rad, i, j, K_ELASTIC, MU,
+                                         EPS)
+    f += f_ships
+    trq += trq_ships
 
     # Wall collisions --> single body collisions
-    wall_info = linear_interpolate(walls, bounds, P)
+    wall_info = wall_lookup(walls, bounds, P, safe)
+    wall_collisions(f, trq, V, W, rad, wall_info, K_ELASTIC, MU_WALL,
+                    DEEP_WALL, WALL_DAMPING)
 
-    # import IPython
-    # IPython.embed()
-    # exit()
+    # Compose the gradient vector
+    return np.hstack((V, W, f/m, trq/I))
 
-    for i in range(n):
-        dist = wall_info[i][0] - rad[i]
-        if dist < 0:
-            normal = wall_info[i][1:3]
 
-            # Linear spring normal force
-            f_norm_mag = -dist*k_elastic
-            f[i] += f_norm_mag * normal
+def sigmoid(x):
+    return -1 + 2./(1. + np.exp(-x))
 
-            # surface tangential force
-            perp = [-normal[1], normal[0]]  # points left 90 degrees
-            v_rel = W[i] * rad[i] - np.dot(V[i], perp)
-            fric = f_norm_mag * mu_wall * sigmoid(v_rel)
-            f[i] += fric*perp
-            trq[i] -= fric * rad[i]
 
-    # Compose the gradient vector
-    return np.hstack((V, W, f/m, trq/I))
+def ship_collisions(P, V, W, rad, i, j, k_elastic, mu, eps):
+    """ Contact forces for every candidate ship pair at once.
+    Args:
+        P, V - n*2 positions and velocities
+        W, rad - n*1 spins and radii
+        i, j - index arrays of candidate pairs (from the broadphase)
+        k_elastic, mu, eps - spring constant, friction coeff, div-zero guard
+    Returns:
+        n*2 force and n*1 torque accumulated over all touching pairs
+    """
+    n = P.shape[0]
+    W = W[:, 0]
+    rad = rad[:, 0]
+
+    # Narrow phase: keep only the pairs that actually overlap
+    dP = P[j] - P[i]
+    dist = np.sqrt(np.sum(dP**2, axis=1)) + eps
+    diameter = rad[i] + rad[j]
+    hit = dist < diameter
+    i, j, dP, dist, diameter = i[hit], j[hit], dP[hit], dist[hit], diameter[hit]
+
+    # Direct collision: linear spring normal force
+    f_magnitude = (diameter-dist)*k_elastic
+    f_norm = f_magnitude[:, np.newaxis] * dP
+
+    # Spin effects (ask Al to draw a free body diagram)
+    perp = np.vstack((-dP[:, 1], dP[:, 0])).T / dist[:, np.newaxis]
+    v_rel = rad[i]*W[i] + rad[j]*W[j] + np.sum((V[i] - V[j])*perp, axis=1)
+    fric = f_magnitude * mu * sigmoid(v_rel)
+    f_pair = fric[:, np.newaxis] * perp - f_norm  # force on i, -force on j
+
+    # Scatter the pair forces back onto the ships
+    f = np.zeros((n, 2))
+    for axis in (0, 1):
+        f[:, axis] = np.bincount(i, f_pair[:, axis], minlength=n) - \
+            np.bincount(j, f_pair[:, axis], minlength=n)
+    trq = -np.bincount(i, fric*rad[i], minlength=n) - \
+        np.bincount(j, fric*rad[j], minlength=n)
+    return f, trq[:, np.newaxis]
+
+
+def wall_collisions(f, trq, V, W, rad, wall_info, k_elastic, mu_wall,
+                    deep_wall, wall_damping):
+    """ Apply wall contact forces to every ship touching a wall, in place.
+    Args:
+        f, trq - n*2 force and n*1 torque accumulators (modified)
+        V - n*2 velocities, W, rad - n*1 spins and radii
+        wall_info - n*3 interpolated (wall distance, normal x, normal y)
+        k_elastic, mu_wall - spring constant and wall friction coeff
+        deep_wall, wall_damping - as for the server: past deep_wall radii
+            into a wall the normal force replaces all others and the
+            velocity is heavily damped
+    """
+    dist = wall_info[:, 0:1] - rad
+    touching = np.flatnonzero(dist[:, 0] < 0)
+    if touching.size == 0:
+        return
+    dist = dist[touching]
+    normal = wall_info[touching, 1:3]
+    v = V[touching]
+    r = rad[touching]
+
+    # Linear spring normal force
+    f_norm_mag = -dist*k_elastic
+    f_norm = f_norm_mag * normal
+
+    # uh-oh - significantly through the wall, so SET the normal force and
+    # seriously damp the velocity
+    deep = dist[:, 0] <= -deep_wall * r[:, 0]
+    f_norm[deep] -= wall_damping * v[deep] + f[touching[deep]]
+
+    # surface tangential force
+    perp = np.vstack((-normal[:, 1], normal[:, 0])).T  # points left 90 degrees
+    v_rel = W[touching] * r - np.sum(v*perp, axis=1)[:, np.newaxis]
+    fric = f_norm_mag * mu_wall * sigmoid(v_rel)
+    f[touching] += f_norm + fric*perp
+    trq[touching] -= fric * r
 
 
 def shortlist_collisions(P, r):
@@ -117,23 +391,72 @@ def shortlist_collisions(P, r):
     return checks
 
 
-def main():
+class RaceMap:
+    """ The layers of a map built by mapbuilder/buildmap.py.
 
-    resources = os.getcwd()[:-8]+'/mapbuilder/testmap_%s.npy'
-
-    wnx = np.load(resources % 'wnormx')
-    wny = np.load(resources % 'wnormy')
-    norm = np.sqrt(wnx**2 + wny**2) + 1e-5
-    wnx /= norm
-    wny /= norm
-    wdist = np.load(resources % 'walldist')
+    Distances and bounds are in world units (pixels / mapscale); start and
+    end are (row, col) pixel coordinates like the server's Map.
+    """
 
-    mapscale = 10
-    walls = np.dstack((wdist/mapscale, wnx, wny))
+    def __init__(self, name, mapscale, walls, occupancy, start, end,
+                 enddist, safe=None, prefix=None):
+        self.name = name
+        self.prefix = prefix  # where load() found it, if it did
+        self.mapscale = mapscale
+        self.walls = walls
+        self.occupancy = occupancy
+        self.start = start
+        self.end = end
+        self.enddist = enddist
+        self.safe = safe
+        self.max_distance = enddist.max()
+        all_shape = np.array(occupancy.shape).astype(float) / mapscale
+        self.bounds = [0, all_shape[1], 0, all_shape[0]]
+
+    @classmethod
+    def load(cls, prefix, mapscale=10.):
+        """ Read the prefix_*.npy layers written by the mapbuilder. """
+        resources = prefix + '_%s.npy'
+
+        wnx = np.load(resources % 'wnormx')
+        wny = np.load(resources % 'wnormy')
+        norm = np.sqrt(wnx**2 + wny**2) + 1e-5
+        wnx /= norm
+        wny /= norm
+        wdist = np.load(resources % 'walldist')
+        walls = np.dstack((wdist/mapscale, wnx, wny))
+
+        # Maps built before the safe layer existed just check every ship
+        safe = None
+        if os.path.exists(resources % 'safe'):
+            safe = np.load(resources % 'safe')
+
+        return cls(os.path.basename(prefix), mapscale, walls,
+                   np.load(resources % 'occupancy'),
+                   np.argwhere(np.load(resources % 'start')),
+                   np.load(resources % 'end'),
+                   np.load(resources % 'enddist'), safe, prefix)
+
+    def pixels(self, P):
+        """ (row, col) pixel of each position, clamped like indices(). """
+        h, w = self.occupancy.shape
+        iy = np.clip((P[:, 1] * self.mapscale).astype(int), 0, h - 1)
+        ix = np.clip((P[:, 0] * self.mapscale).astype(int), 0, w - 1)
+        return iy, ix
+
+
+def main(seed=None, record=None):
+    """ Interactive sandbox: arrow keys fly ship 0.
+    Args:
+        seed - seed for the spawn (random if None)
+        record - optional directory to write a replay.Recorder log to
+    """
+    import matplotlib.pyplot as pl
 
-    map_img = np.load(resources % 'occupancy')  # 'walldist')
-    all_shape = np.array(map_img.shape).astype(float) / mapscale
-    bounds = [0, all_shape[1], 0, all_shape[0]]
+    racemap = RaceMap.load(os.getcwd()[:-8]+'/mapbuilder/testmap', mapscale=10)
+    walls = racemap.walls
+    bounds = racemap.bounds
+    map_img = racemap.occupancy  # 'walldist')
     # map_img = 0.25*(map_img[::2, ::2] + map_img[1::2,::2] + \
     #                 map_img[::2, 1::2] + map_img[1::2, 1::2])
     spawn = np.array([25, 25])/2.  # x, y
@@ -141,7 +464,8 @@ def main():
     
 
     n = 30
-    masses = 1. + 2*np.random.random(n)
+    rng = np.random.RandomState(seed)
+    masses = 1. + 2*rng.random_sample(n)
     masses[0] = 1.
     Is = 0.25*masses
     radius = np.ones(n)
@@ -151,12 +475,12 @@ def main():
     colours = (colours * np.ceil(n/len(colours)))[:n]
     colours[0] = 'k'
     # x, y, th, vx, vy, w
-    x0 = 2*(np.random.random(n) - 0.5) * spawn_size + spawn[0]
-    y0 = 2*(np.random.random(n) - 0.5) * spawn_size + spawn[1]
-    th0 = np.random.random(n) * np.pi * 2
-    vx0 = np.random.random(n) * 2 - 1
-    vy0 = np.random.random(n) * 2 - 1
-    w0 = np.random.random(n) * 2 - 1
+    x0 = 2*(rng.random_sample(n) - 0.5) * spawn_size + spawn[0]
+    y0 = 2*(rng.random_sample(n) - 0.5) * spawn_size + spawn[1]
+    th0 = rng.random_sample(n) * np.pi * 2
+    vx0 = rng.random_sample(n) * 2 - 1
+    vy0 = rng.random_sample(n) * 2 - 1
+    w0 = rng.random_sample(n) * 2 - 1
     states0 = np.vstack((x0, y0, th0, vx0, vy0, w0)).T
 
     # Set up our spaceships
@@ -192,6 +516,11 @@ def main():
     frame_rate = 30.
     frame_time = 1./frame_rate
     next_draw = frame_time
+    recorder = None
+    if record is not None:
+        from replay import Recorder
+        recorder = Recorder(record, racemap, states0, properties, dt,
+                            seed=seed)
 
     keys = set()
     def press(event):
@@ -232,7 +561,10 @@ def main():
             else:
                 inputs[0, 0] = 0
             t += dt
-            integrate(states, properties, inputs, walls, bounds, dt)
+            integrate(states, properties, inputs, walls, bounds, dt,
+                      safe=racemap.safe)
+            if recorder is not None:
+                recorder.record(inputs, states)
         
         # Draw at the desired framerate
         this_time = time() - start_time
@@ -249,6 +581,9 @@ def main():
         else:
             sleep((next_draw - this_time)*0.25)
 
+    if recorder is not None:
+        recorder.close()
+
 
 def draw_outline(ax, state, c, radius, handle=None, n=15):
     x, y, th, vx, vy, w = state
@@ -277,6 +612,39 @@ def draw_outline(ax, state, c, radius, handle=None, n=15):
     return handle
 
 
+def wall_lookup(walls, bounds, pos, safe=None):
+    """ Interpolated (wall distance, normal x, normal y) at each position.
+
+    Ships on safe pixels skip the interpolation and are reported as
+    infinitely far from any wall.
+    """
+    if safe is None:
+        return linear_interpolate(walls, bounds, pos)
+    ix, iy = grid_coords(safe.shape, bounds, pos)
+    check = np.flatnonzero(~safe[iy.astype(int), ix.astype(int)])
+    wall_info = np.zeros((pos.shape[0], walls.shape[2]))
+    wall_info[:, 0] = np.inf
+    wall_info[check] = linear_interpolate(walls, bounds, pos[check])
+    return wall_info
+
+
+def grid_coords(shape, bounds, pos):
+    """ Fractional (col, row) pixel coordinates, clamped so the pixel one
+    further along in each direction still exists.
+    """
+    h, w = shape[:2]
+    xmin, xmax, ymin, ymax = bounds
+    x, y = pos.T
+    ix = (x - xmin) / (xmax - xmin) * (w - 1.)
+    iy = (y - ymin) / (ymax - ymin) * (h - 1.)
+    if not (np.isfinite(ix).all() and np.isfinite(iy).all()):
+        raise FloatingPointError('Non-finite ship position(s) {}'.format(
+            np.flatnonzero(~np.isfinite(pos).all(axis=1)).tolist()))
+    ix = np.minimum(np.maximum(0, ix), w-2)
+    iy = np.minimum(np.maximum(0, iy), h-2)
+    return ix, iy
+
+
 def linear_interpolate(img, bounds, pos):
     """ Used for interpreting Dan-maps
     Args:
@@ -286,13 +654,7 @@ def linear_interpolate(img, bounds, pos):
     Returns:
         interpolated vector
     """
-    h, w, ch = np.shape(img)
-    xmin, xmax, ymin, ymax = bounds
-    x, y = pos.T
-    ix = (x - xmin) / (xmax - xmin) * (w - 1.)
-    iy = (y - ymin) / (ymax - ymin) * (h - 1.)
-    ix = np.minimum(np.maximum(0, ix), w-2)
-    iy = np.minimum(np.maximum(0, iy), h-2)
+    ix, iy = grid_coords(np.shape(img), bounds, pos)
     L = ix.astype(int)
     T = iy.astype(int)
     alphax = (ix - L)[:,np.newaxis]
@@ -328,4 +690,10 @@ def old_shortlist_collisions(P, r):
 
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description='Spacerace: physics sandbox')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--record', default=None,
+                        help='Directory to record the session to')
+    args = parser.parse_args()
+    main(args.seed, args.record)
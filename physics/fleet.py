@@ -0,0 +1,252 @@
+""" Struct-of-arrays float32 ship state with an allocation-free RK4 step.
+
+engine.integrate works on an n*6 float64 matrix and builds new arrays for
+every column slice, RK4 stage and hstack. Here each state field is its own
+contiguous float32 row (the server's StateMatrix is float too). Every
+per-ship temporary is allocated once, when the stepper is built. Allocation
+that remains happens in the broadphase sort, in the wall gather for ships
+off the map's safe pixels, and in the shared contact kernels. The wall
+kernel only runs when some ship is touching a wall, but the ship kernel
+(which does its own narrow phase) runs whenever the broadphase shortlists
+any pair, so a tight formation allocates every stage even without contact.
+"""
+import numpy as np
+
+from broadphase import shortlist_pairs
+from engine import (DEEP_WALL, EPS, K_ELASTIC, MU, MU_WALL, RHO,
+                    SPIN_DRAG_RATIO, WALL_DAMPING, ship_collisions,
+                    wall_collisions)
+
+FIELDS = ('x', 'y', 'th', 'vx', 'vy', 'w')
+PROPS = ('m', 'I', 'rad', 'cd_a')
+
+
+class Fleet:
+    """ Ship states as a (6, n) array, one contiguous row per field.
+
+    The rows are also exposed by name: fleet.x, fleet.vy, ...
+    """
+
+    def __init__(self, n, dtype=np.float32):
+        self.data = np.zeros((len(FIELDS), n), dtype)
+        for row, name in zip(self.data, FIELDS):
+            setattr(self, name, row)
+
+    @classmethod
+    def from_matrix(cls, states, dtype=np.float32):
+        """ Build from an engine style n*6 (x, y, th, vx, vy, w) matrix. """
+        fleet = cls(states.shape[0], dtype)
+        fleet.data[...] = states.T
+        return fleet
+
+    def matrix(self):
+        """ n*6 view in the engine's layout (not contiguous). """
+        return self.data.T
+
+    def __len__(self):
+        return self.data.shape[1]
+
+
+class FleetStepper:
+    """ In-place RK4 for a Fleet, with all buffers allocated up front.
+
+    Args:
+        n - fleet size
+        props - n*4 (mass, inertia, radius, cd_a)
+        walls, bounds - the map, as for engine.integrate
+        safe - optional contact-free pixel mask, see engine.physics
+        dtype - float type of every buffer
+    """
+
+    def __init__(self, n, props, walls, bounds, safe=None,
+                 dtype=np.float32):
+        self.n = n
+        self.dtype = dtype
+        self.props = np.ascontiguousarray(np.asarray(props).T, dtype)
+        self.m, self.I, self.rad, self.cd_a = self.props
+        self.rad_col = self.rad[:, np.newaxis]
+
+        # Map layers flattened so gathers can use np.take(..., out=...)
+        h, w, ch = walls.shape
+        self.map_shape = (h, w)
+        self.walls = np.ascontiguousarray(walls, dtype).reshape(h * w, ch)
+        self.safe = None if safe is None else np.ascontiguousarray(
+            safe, bool).ravel()
+        xmin, xmax, ymin, ymax = bounds
+        self.origin = (xmin, ymin)
+        self.scale = ((w - 1.) / (xmax - xmin), (h - 1.) / (ymax - ymin))
+
+        # RK4 stages and the stage input state
+        self.k = np.zeros((4, len(FIELDS), n), dtype)
+        self.stage = np.zeros((len(FIELDS), n), dtype)
+        self.inp = np.zeros((2, n), dtype)
+
+        # Per-ship scratch
+        self.P = np.zeros((n, 2), dtype)
+        self.V = np.zeros((n, 2), dtype)
+        self.f = np.zeros((n, 2), dtype)
+        self.trq = np.zeros((n, 1), dtype)
+        self.tmp = np.zeros(n, dtype)
+        self.tmp2 = np.zeros(n, dtype)
+        self.ix = np.zeros(n, dtype)
+        self.iy = np.zeros(n, dtype)
+        self.ax = np.zeros((n, 1), dtype)
+        self.ay = np.zeros((n, 1), dtype)
+        self.bx = np.zeros((n, 1), dtype)
+        self.by = np.zeros((n, 1), dtype)
+        self.cell = np.zeros(n, np.intp)
+        self.cell_tmp = np.zeros(n, np.intp)
+        self.corner = np.zeros((n, ch), dtype)
+        self.wall_info = np.zeros((n, ch), dtype)
+        self.on_safe = np.zeros(n, bool)
+        self.touching = np.zeros(n, bool)
+
+    def step(self, fleet, inp, dt):
+        """ Advance fleet by dt in place under n*2 (thrust, torque) inputs. """
+        np.copyto(self.inp, inp.T, casting='unsafe')
+        k1, k2, k3, k4 = self.k
+        y = fleet.data
+        self.derivatives(y, k1)
+        np.multiply(k1, 0.5*dt, out=self.stage)
+        self.stage += y
+        self.derivatives(self.stage, k2)
+        np.multiply(k2, 0.5*dt, out=self.stage)
+        self.stage += y
+        self.derivatives(self.stage, k3)
+        np.multiply(k3, dt, out=self.stage)
+        self.stage += y
+        self.derivatives(self.stage, k4)
+
+        # y += (k1 + 2*k2 + 2*k3 + k4)/6 * dt, reusing k2 as the accumulator
+        k2 += k3
+        k2 *= 2.
+        k2 += k1
+        k2 += k4
+        k2 *= dt / 6.
+        y += k2
+
+    def derivatives(self, y, out):
+        """ engine.physics for a (6, n) state, written into out (6, n). """
+        x, yy, th, vx, vy, w = y
+        thrust, torque = self.inp
+        f, trq, tmp = self.f, self.trq, self.tmp
+        fx, fy = f[:, 0], f[:, 1]
+        t = trq[:, 0]
+
+        # Thrust
+        np.cos(th, out=tmp)
+        np.multiply(thrust, tmp, out=fx)
+        np.sin(th, out=tmp)
+        np.multiply(thrust, tmp, out=fy)
+
+        # Drag
+        np.hypot(vx, vy, out=tmp)
+        tmp *= self.cd_a
+        tmp *= RHO
+        np.multiply(tmp, vx, out=self.tmp2)
+        fx -= self.tmp2
+        np.multiply(tmp, vy, out=self.tmp2)
+        fy -= self.tmp2
+        np.abs(w, out=tmp)
+        tmp *= w
+        tmp *= self.cd_a
+        tmp *= self.rad
+        tmp *= self.rad
+        tmp *= SPIN_DRAG_RATIO * RHO
+        np.subtract(torque, tmp, out=t)
+
+        # Inter-ship collisions
+        self.P[:, 0] = x
+        self.P[:, 1] = yy
+        self.V[:, 0] = vx
+        self.V[:, 1] = vy
+        W = w[:, np.newaxis]
+        i, j = shortlist_pairs(self.P, 1.)
+        if i.size:  # candidates only, ship_collisions keeps the overlaps
+            f_ships, trq_ships = ship_collisions(
+                self.P, self.V, W, self.rad_col, i, j, K_ELASTIC, MU, EPS)
+            f += f_ships
+            trq += trq_ships
+
+        # Wall collisions
+        self.interpolate(x, yy)
+        np.less(self.wall_info[:, 0], self.rad, out=self.touching)
+        if self.touching.any():
+            wall_collisions(f, trq, self.V, W, self.rad_col, self.wall_info,
+                            K_ELASTIC, MU_WALL, DEEP_WALL, WALL_DAMPING)
+
+        # Compose the gradient
+        out[0] = vx
+        out[1] = vy
+        out[2] = w
+        np.divide(fx, self.m, out=out[3])
+        np.divide(fy, self.m, out=out[4])
+        np.divide(t, self.I, out=out[5])
+
+    def interpolate(self, x, y):
+        """ engine.wall_lookup into self.wall_info. Only allocates for the
+        ships off the safe pixels, when there is a safe mask.
+        """
+        h, w = self.map_shape
+        ix, iy, ax, ay, bx, by = (self.ix, self.iy, self.ax, self.ay,
+                                  self.bx, self.by)
+        cell, corner, info = self.cell, self.corner, self.wall_info
+
+        np.subtract(x, self.origin[0], out=ix)
+        ix *= self.scale[0]
+        np.clip(ix, 0, w - 2, out=ix)
+        np.subtract(y, self.origin[1], out=iy)
+        iy *= self.scale[1]
+        np.clip(iy, 0, h - 2, out=iy)
+
+        # Top left pixel of each ship, and how far across it the ship is
+        np.floor(ix, out=ax[:, 0])
+        np.floor(iy, out=ay[:, 0])
+        np.copyto(cell, ay[:, 0], casting='unsafe')
+        cell *= w
+        np.copyto(self.cell_tmp, ax[:, 0], casting='unsafe')
+        cell += self.cell_tmp
+        np.subtract(ix, ax[:, 0], out=ax[:, 0])
+        np.subtract(iy, ay[:, 0], out=ay[:, 0])
+        np.subtract(1., ax, out=bx)
+        np.subtract(1., ay, out=by)
+
+        if self.safe is None:
+            self.blend(cell, ax, ay, bx, by, info, corner, self.cell_tmp)
+            return
+
+        # Only ships off the safe pixels need the walls at all
+        np.take(self.safe, cell, out=self.on_safe)
+        info[:, 0] = np.inf
+        info[:, 1:] = 0.
+        near = np.flatnonzero(~self.on_safe)
+        if near.size:
+            sub = np.empty((near.size, info.shape[1]), self.dtype)
+            self.blend(cell[near], ax[near], ay[near], bx[near], by[near],
+                       sub, np.empty_like(sub), np.empty_like(near))
+            info[near] = sub
+
+    def blend(self, cell, ax, ay, bx, by, out, corner, cell_tmp):
+        """ Bilinear blend of the four pixels from each top left cell, with
+        fractions (ax, ay) across it and (bx, by) = 1 - (ax, ay), into out.
+        corner and cell_tmp are scratch shaped like out and cell.
+        """
+        w = self.map_shape[1]
+        np.take(self.walls, cell, axis=0, out=out)
+        out *= bx
+        out *= by
+        np.add(cell, w, out=cell_tmp)
+        np.take(self.walls, cell_tmp, axis=0, out=corner)
+        corner *= bx
+        corner *= ay
+        out += corner
+        np.add(cell, 1, out=cell_tmp)
+        np.take(self.walls, cell_tmp, axis=0, out=corner)
+        corner *= ax
+        corner *= by
+        out += corner
+        cell_tmp += w
+        np.take(self.walls, cell_tmp, axis=0, out=corner)
+        corner *= ax
+        corner *= ay
+        out += corner
@@ -0,0 +1,209 @@
+""" Replay a recorded server game through Python physics, tick by tick.
+
+    python golden.py game3.jsonl \\
+        --map ../maps/etd-winter-retreat-2015/bt-circle1
+
+The log holds the state frames the server published, one JSON per line
+(clients/zmq/record_client.py writes them). Starting from the first frame,
+each model re-flies the recorded controls and we report how far its ships
+are from the server's own positions at every frame:
+
+    open  - free running from frame 0, so errors compound
+    reset - restart from the recorded frame every tick, so each row is the
+            error of predicting a single frame ahead
+
+The server model (server_physics.py) matches the compiled C++ bit for bit,
+but frames carry positions in pixels, so states recovered from them can be
+an ulp off. In a crowded race that alone makes free running replays drift,
+so judge parity on --reset, which should agree to float32 rounding. The
+sandbox model is engine.physics() and shows how far the sandbox has drifted
+from the server. Frames only carry the controls as they were at broadcast
+time; we assume frame k's (Tl, Tr) drove the step to frame k+1, which fails
+for a tick whenever a control arrived while the server was integrating.
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+import server_physics
+from engine import RaceMap, integrate
+from headless import DEFAULT_SETTINGS, load_settings
+
+F32 = np.float32
+
+
+def load_frames(filename, game=None):
+    """ The running frames of one game (default: the first one logged). """
+    frames = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            frame = json.loads(line)
+            if frame.get('state') != 'running':
+                continue
+            if game is None:
+                game = frame['name']
+            if frame['name'] == game:
+                frames.append(frame)
+    if not frames:
+        raise ValueError('No running frames in {}'.format(filename))
+    return frames
+
+
+def frame_arrays(frames, map_scale):
+    """ Unpack frames into server layout arrays.
+
+    Ships are ordered by id, which is also the server's state row order.
+    Returns:
+        ids - list of ship ids
+        states - (frames, n, 6) float32 (x, y, vx, vy, theta, omega)
+        ctrls - (frames, n, 2) float32 (Tl, Tr)
+    """
+    ids = sorted(frames[0]['data'])
+    scale = F32(map_scale)
+    states = np.zeros((len(frames), len(ids), 6), F32)
+    ctrls = np.zeros((len(frames), len(ids), 2), F32)
+    for k, frame in enumerate(frames):
+        if len(frame['data']) != len(ids):
+            raise ValueError('The fleet changed at frame {}'.format(k))
+        for row, ship in enumerate(ids):
+            d = frame['data'][ship]
+            states[k, row] = [d['x'], d['y'], d['vx'], d['vy'],
+                              d['theta'], d['omega']]
+            ctrls[k, row] = [d['Tl'], d['Tr']]
+    # Positions and velocities are broadcast in pixels
+    states[:, :, 0:4] /= scale
+    return ids, states, ctrls
+
+
+def server_model(prefix, settings, masses):
+    """ Frame stepper for server_physics (bit-for-bit the C++ rules). """
+    params = server_physics.SimulationParameters(settings)
+    smap = server_physics.ServerMap.load(prefix, params.map_scale)
+
+    def step(states, ctrls):
+        server_physics.step_frame(states, ctrls, masses, params, smap)
+    return step
+
+
+def sandbox_model(prefix, settings, masses):
+    """ Frame stepper for engine.physics(), converted to server layout. """
+    params = server_physics.SimulationParameters(settings)
+    racemap = RaceMap.load(prefix, float(params.map_scale))
+    masses = np.asarray(masses, float)
+    props = np.vstack((masses, 0.25*masses, np.ones_like(masses),
+                       np.ones_like(masses))).T
+    thrust = np.array([params.linear_thrust, params.rotational_thrust],
+                      float)
+    to_engine = [0, 1, 4, 2, 3, 5]  # server layout -> (x, y, th, vx, vy, w)
+
+    def step(states, ctrls):
+        sandbox = states[:, to_engine].astype(float)
+        for _ in range(params.integration_steps):
+            integrate(sandbox, props, ctrls * thrust, racemap.walls,
+                      racemap.bounds, float(params.time_step),
+                      safe=racemap.safe)
+        states[:, to_engine] = sandbox
+        server_physics.wrap_theta(states)
+    return step
+
+
+MODELS = {
+    'server': server_model,
+    'sandbox': sandbox_model,
+}
+
+
+def replay(step, golden, ctrls, reset=False):
+    """ Predict every frame after the first.
+    Args:
+        step - callable(states, ctrls) advancing one frame in place
+        golden - (frames, n, 6) recorded states
+        ctrls - (frames, n, 2) recorded controls
+        reset - restart from the recording every frame
+    Returns:
+        (frames, n, 6) predictions; the first frame is copied as is
+    """
+    predicted = np.empty_like(golden)
+    predicted[0] = golden[0]
+    for k in range(1, len(golden)):
+        states = (golden if reset else predicted)[k - 1].copy()
+        step(states, ctrls[k - 1])
+        predicted[k] = states
+    return predicted
+
+
+def divergence(predicted, golden):
+    """ Per frame error statistics, in world units and radians. """
+    position = np.sqrt(np.sum((predicted[:, :, :2].astype(float) -
+                               golden[:, :, :2])**2, axis=2))
+    velocity = np.sqrt(np.sum((predicted[:, :, 2:4].astype(float) -
+                               golden[:, :, 2:4])**2, axis=2))
+    theta = np.abs(np.angle(np.exp(1j * (predicted[:, :, 4].astype(float) -
+                                         golden[:, :, 4]))))
+    return dict(position_mean=position.mean(axis=1),
+                position_max=position.max(axis=1),
+                velocity_max=velocity.max(axis=1),
+                theta_max=theta.max(axis=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Spacerace: replay recorded frames, report divergence')
+    parser.add_argument('log', help='JSON lines of state frames')
+    parser.add_argument('--map', default=None,
+                        help='Map prefix (default: ../maps/ + frame map)')
+    parser.add_argument('--game', default=None,
+                        help='Game name (default: first in the log)')
+    parser.add_argument('--model', default='server', choices=sorted(MODELS))
+    parser.add_argument('--reset', action='store_true',
+                        help='Predict one frame ahead from each recording')
+    parser.add_argument('--densities', default=None,
+                        help='JSON {ship id: density} (default: '
+                        'defaultDensity for everyone)')
+    parser.add_argument('--every', type=int, default=30,
+                        help='Print every this many frames')
+    parser.add_argument('--settings', default=DEFAULT_SETTINGS)
+    parser.add_argument('--output', default=None,
+                        help='Write per-frame errors to this JSON file')
+    args = parser.parse_args()
+
+    settings = load_settings(args.settings)
+    map_scale = settings['simulation']['world']['mapScale']
+    frames = load_frames(args.log, args.game)
+    ids, golden, ctrls = frame_arrays(frames, map_scale)
+    prefix = args.map or os.path.join('..', settings['mapPath'],
+                                      frames[0]['map'])
+
+    density = settings['simulation']['ship']['defaultDensity']
+    masses = np.full(len(ids), density, F32)
+    if args.densities:
+        with open(args.densities) as f:
+            given = json.load(f)
+        masses[:] = [given.get(ship, density) for ship in ids]
+
+    step = MODELS[args.model](prefix, settings, masses)
+    predicted = replay(step, golden, ctrls, args.reset)
+    errors = divergence(predicted, golden)
+
+    print('{} frames, {} ships, {} model ({})'.format(
+        len(frames), len(ids), args.model,
+        'one frame ahead' if args.reset else 'free running'))
+    print('{:>6} {:>12} {:>12} {:>12} {:>10}'.format(
+        'frame', 'pos mean', 'pos max', 'vel max', 'theta max'))
+    for k in list(range(0, len(frames), args.every)) + [len(frames) - 1]:
+        print('{:>6} {:>12.3g} {:>12.3g} {:>12.3g} {:>10.3g}'.format(
+            k, *[errors[e][k] for e in ('position_mean', 'position_max',
+                                        'velocity_max', 'theta_max')]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(ids=ids, model=args.model, reset=args.reset,
+                           **{e: v.tolist() for e, v in errors.items()}), f)
+
+
+if __name__ == '__main__':
+    main()
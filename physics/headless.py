@@ -0,0 +1,178 @@
+""" Headless, faster-than-real-time races on the Python engine.
+
+    python headless.py ../maps/etd-winter-retreat-2015/bt-circle1 --ships 30
+
+No plotting and no frame clock: the race advances as fast as the CPU allows
+and reports how many simulated seconds it managed per wall-clock second.
+A controller is any callable (t, states) -> n*2 array of server style
+controls (linear in [0, 1], rotation in [-1, 1]).
+"""
+import argparse
+import importlib
+import json
+import numpy as np
+from time import time
+
+from engine import BACKENDS, METHODS, RaceMap, integrate, set_backend
+from replay import Recorder
+
+DEFAULT_SETTINGS = '../config/spacerace.json'
+
+
+def load_settings(filename=DEFAULT_SETTINGS):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def spawn_states(racemap, n, rng=np.random):
+    """ Start states scattered over the map's start pixels.
+
+    Mirrors the server's initialiseState(): shuffle the start pixels, deal
+    them out to the ships in turn, jitter within the pixel and point each
+    ship in a random direction, at rest.
+    """
+    pixels = racemap.start[rng.permutation(len(racemap.start))]
+    rows, cols = pixels[np.arange(n) % len(pixels)].T
+    states = np.zeros((n, 6))
+    states[:, 0] = (cols + rng.random_sample(n)) / racemap.mapscale
+    states[:, 1] = (rows + rng.random_sample(n)) / racemap.mapscale
+    states[:, 2] = rng.random_sample(n) * 2 * np.pi
+    return states
+
+
+def ship_properties(n, density=1.):
+    # mass, inertia, radius, cd_a - inertia to mass ratio as on the server
+    masses = density * np.ones(n)
+    return np.vstack((masses, 0.25*masses, np.ones(n), np.ones(n))).T
+
+
+def full_thrust(t, states):
+    return np.tile([1., 0.], (states.shape[0], 1))
+
+
+def load_controller(spec):
+    """ Import a controller given as 'module:function'. """
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+class HeadlessRace:
+    """ One race on one map, stepped without any real-time pacing.
+
+    Args:
+        racemap - engine.RaceMap
+        n_ships - fleet size
+        controller - callable(t, states) -> n*2 controls
+        settings - parsed spacerace.json (thrusts, density and game time)
+        dt - integration time step, default the server's timeStep
+        seed - seed for the spawn positions
+        method - integrator name, see engine.METHODS
+    """
+
+    def __init__(self, racemap, n_ships, controller, settings, dt=None,
+                 seed=None, method='rk4'):
+        ship = settings['simulation']['ship']
+        if dt is None:
+            dt = settings['simulation']['timeStep']
+        self.racemap = racemap
+        self.controller = controller
+        self.dt = dt
+        self.method = method
+        self.thrust = np.array([ship['linearThrust'],
+                                ship['rotationalThrust']])
+        self.game_time = settings['gameTime']
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.states = spawn_states(racemap, n_ships, self.rng)
+        self.props = ship_properties(n_ships, ship['defaultDensity'])
+        self.t = 0.
+        self.steps = 0
+        self.recorder = None
+
+    def record(self, path, snapshot_every=50):
+        """ Log every step from here on to a replay.Recorder at path. """
+        self.recorder = Recorder(path, self.racemap, self.states, self.props,
+                                 self.dt, self.method, snapshot_every,
+                                 self.seed)
+        return self.recorder
+
+    def step(self):
+        inputs = self.controller(self.t, self.states) * self.thrust
+        integrate(self.states, self.props, inputs, self.racemap.walls,
+                  self.racemap.bounds, self.dt, method=self.method,
+                  safe=self.racemap.safe)
+        if self.recorder is not None:
+            self.recorder.record(inputs, self.states)
+        self.t += self.dt
+        self.steps += 1
+
+    def winners(self):
+        """ Indices of ships sitting on the finish line. """
+        return np.flatnonzero(self.racemap.end[self.racemap.pixels(
+            self.states[:, :2])])
+
+    def scores(self):
+        """ Track progress per ship, maxDistance - endDistance. """
+        distance = self.racemap.enddist[self.racemap.pixels(
+            self.states[:, :2])]
+        return self.racemap.max_distance - distance
+
+    def run(self, duration=None):
+        """ Race until someone finishes or duration (default gameTime) is up.
+        Returns:
+            dict of simulated time, wall time and their ratio
+        """
+        duration = self.game_time if duration is None else duration
+        n_steps = int(round(duration / self.dt))
+        start = time()
+        for _ in range(n_steps):
+            self.step()
+            if self.winners().size:
+                break
+        wall = time() - start
+        return dict(sim_seconds=self.t, wall_seconds=wall,
+                    speedup=self.t / max(wall, 1e-9), steps=self.steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spacerace: headless race')
+    parser.add_argument('map', help='Map prefix, e.g. maps/foo/bar for the '
+                                    'bar_*.npy layers built by buildmap.py')
+    parser.add_argument('--ships', type=int, default=30)
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Simulated seconds (default: gameTime)')
+    parser.add_argument('--dt', type=float, default=None,
+                        help='Time step (default: timeStep from settings)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--integrator', default='rk4',
+                        choices=METHODS)
+    parser.add_argument('--controller', default='headless:full_thrust',
+                        help='module:function to drive every ship')
+    parser.add_argument('--backend', default='numpy', choices=BACKENDS,
+                        help='physics backend (numba is compiled, if present)')
+    parser.add_argument('--record', default=None,
+                        help='Directory to record the race to, see replay.py')
+    parser.add_argument('--settings', default=DEFAULT_SETTINGS)
+    args = parser.parse_args()
+
+    set_backend(args.backend)
+    settings = load_settings(args.settings)
+    mapscale = settings['simulation']['world']['mapScale']
+    racemap = RaceMap.load(args.map, mapscale)
+    race = HeadlessRace(racemap, args.ships, load_controller(args.controller),
+                        settings, args.dt, args.seed, args.integrator)
+    if args.record:
+        race.record(args.record)
+    stats = race.run(args.duration)
+    if args.record:
+        race.recorder.close()
+    print('Simulated {sim_seconds:.1f}s in {wall_seconds:.2f}s '
+          '({speedup:.1f} sim-seconds per second, {steps} steps)'
+          .format(**stats))
+    scores = race.scores()
+    for i in np.argsort(-scores):
+        print('ship {:4d}: {:8.1f}'.format(i, scores[i]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+""" Numba-compiled physics backend.
+
+    python jit.py   # parity check against the NumPy engine, plus timings
+
+Loop-per-ship versions of the broadphase, map interpolation and physics().
+For small fleets they skip the fixed overhead of the vectorised NumPy path.
+Select the backend with engine.set_backend('numba'). Without numba installed
+the engine keeps its NumPy path, and the functions here still run as plain
+(slow) Python.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def available():
+    return njit is not None
+
+
+def _compile(fn):
+    return njit(cache=True)(fn) if njit is not None else fn
+
+
+@_compile
+def sigmoid(x):
+    return -1. + 2./(1. + np.exp(-x))
+
+
+@_compile
+def _shortlist(P, r, groups):
+    n = P.shape[0]
+    grid = r * 2. + 1e-5  # base off diameter
+    cx = np.empty(n, np.int64)
+    cy = np.empty(n, np.int64)
+    for a in range(n):
+        cx[a] = np.int64(np.floor(P[a, 0] / grid))
+        cy[a] = np.int64(np.floor(P[a, 1] / grid))
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    width = cx.max() + 2
+    height = cy.max() + 2
+    key = cy * width + cx + groups * (width * height)
+    order = np.argsort(key, kind='mergesort')
+    sk = key[order]
+
+    # Home cell plus half the neighbours, as in broadphase.NEIGHBOURS
+    offsets = np.array([0, 1 - width, 1, 1 + width, width])
+    lo = np.empty((n, 5), np.int64)
+    hi = np.empty((n, 5), np.int64)
+    total = 0
+    for a in range(n):
+        for o in range(5):
+            q = sk[a] + offsets[o]
+            lo[a, o] = np.searchsorted(sk, q)
+            hi[a, o] = np.searchsorted(sk, q, side='right')
+            if o == 0:
+                lo[a, o] = max(lo[a, o], a + 1)
+            total += max(hi[a, o] - lo[a, o], 0)
+
+    first = np.empty(total, np.int64)
+    second = np.empty(total, np.int64)
+    k = 0
+    for a in range(n):
+        for o in range(5):
+            for b in range(lo[a, o], hi[a, o]):
+                first[k] = order[a]
+                second[k] = order[b]
+                k += 1
+    return first, second
+
+
+def shortlist_pairs(P, r, groups=None):
+    """ Compiled broadphase.shortlist_pairs (same pairs, possibly in a
+    different order).
+    """
+    n = P.shape[0]
+    if n < 2:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    if groups is None:
+        groups = np.zeros(n, np.int64)
+    return _shortlist(np.ascontiguousarray(P, np.float64), float(r),
+                      np.asarray(groups, np.int64))
+
+
+@_compile
+def _interpolate(img, xmin, xmax, ymin, ymax, x, y, out):
+    h, w, ch = img.shape
+    ix = (x - xmin) / (xmax - xmin) * (w - 1.)
+    iy = (y - ymin) / (ymax - ymin) * (h - 1.)
+    ix = min(max(0., ix), w - 2.)
+    iy = min(max(0., iy), h - 2.)
+    L = int(ix)
+    T = int(iy)
+    ax = ix - L
+    ay = iy - T
+    for c in range(ch):
+        out[c] = (1.-ax)*(1.-ay)*img[T, L, c] + \
+            (1.-ax)*ay*img[T+1, L, c] + \
+            ax*(1.-ay)*img[T, L+1, c] + \
+            ax*ay*img[T+1, L+1, c]
+
+
+@_compile
+def _interpolate_all(img, xmin, xmax, ymin, ymax, pos):
+    out = np.empty((pos.shape[0], img.shape[2]))
+    for a in range(pos.shape[0]):
+        _interpolate(img, xmin, xmax, ymin, ymax, pos[a, 0], pos[a, 1],
+                     out[a])
+    return out
+
+
+def linear_interpolate(img, bounds, pos):
+    """ Compiled engine.linear_interpolate. """
+    xmin, xmax, ymin, ymax = [float(b) for b in bounds]
+    return _interpolate_all(img, xmin, xmax, ymin, ymax,
+                            np.ascontiguousarray(pos, np.float64))
+
+
+@_compile
+def _derivatives(states, props, inp, walls, xmin, xmax, ymin, ymax, pi, pj,
+                 safe, use_safe, rho, k_elastic, spin_drag_ratio, eps, mu,
+                 mu_wall, deep_wall, wall_damping):
+    n = states.shape[0]
+    h, w, ch = walls.shape
+    f = np.zeros((n, 2))
+    trq = np.zeros(n)
+
+    # Thrust and drag
+    for a in range(n):
+        th = states[a, 2]
+        vx = states[a, 3]
+        vy = states[a, 4]
+        om = states[a, 5]
+        rad = props[a, 2]
+        cd_a = props[a, 3]
+        speed = np.sqrt(vx*vx + vy*vy)
+        f[a, 0] = inp[a, 0] * np.cos(th) - cd_a * rho * vx * speed
+        f[a, 1] = inp[a, 0] * np.sin(th) - cd_a * rho * vy * speed
+        trq[a] = inp[a, 1] - spin_drag_ratio * cd_a * rho * om * abs(om) * \
+            rad**2
+
+    # Inter-ship collisions
+    for k in range(pi.shape[0]):
+        i = pi[k]
+        j = pj[k]
+        dx = states[j, 0] - states[i, 0]
+        dy = states[j, 1] - states[i, 1]
+        dist = np.sqrt(dx*dx + dy*dy) + eps
+        diameter = props[i, 2] + props[j, 2]
+        if dist < diameter:
+            f_magnitude = (diameter - dist) * k_elastic
+            f[i, 0] -= f_magnitude * dx
+            f[i, 1] -= f_magnitude * dy
+            f[j, 0] += f_magnitude * dx
+            f[j, 1] += f_magnitude * dy
+
+            px = -dy / dist
+            py = dx / dist
+            v_rel = props[i, 2]*states[i, 5] + props[j, 2]*states[j, 5] + \
+                (states[i, 3] - states[j, 3])*px + \
+                (states[i, 4] - states[j, 4])*py
+            fric = f_magnitude * mu * sigmoid(v_rel)
+            f[i, 0] += fric * px
+            f[i, 1] += fric * py
+            f[j, 0] -= fric * px
+            f[j, 1] -= fric * py
+            trq[i] -= fric * props[i, 2]
+            trq[j] -= fric * props[j, 2]
+
+    # Wall collisions
+    info = np.empty(ch)
+    for a in range(n):
+        x = states[a, 0]
+        y = states[a, 1]
+        if use_safe:
+            ix = min(max(0., (x - xmin) / (xmax - xmin) * (w - 1.)), w - 2.)
+            iy = min(max(0., (y - ymin) / (ymax - ymin) * (h - 1.)), h - 2.)
+            if safe[int(iy), int(ix)]:
+                continue
+        _interpolate(walls, xmin, xmax, ymin, ymax, x, y, info)
+        rad = props[a, 2]
+        dist = info[0] - rad
+        if dist < 0:
+            nx = info[1]
+            ny = info[2]
+            vx = states[a, 3]
+            vy = states[a, 4]
+            f_norm_mag = -dist * k_elastic
+            if dist <= -deep_wall * rad:
+                f[a, 0] = f_norm_mag*nx - wall_damping*vx
+                f[a, 1] = f_norm_mag*ny - wall_damping*vy
+            else:
+                f[a, 0] += f_norm_mag*nx
+                f[a, 1] += f_norm_mag*ny
+            v_rel = states[a, 5] * rad + vx*ny - vy*nx
+            fric = f_norm_mag * mu_wall * sigmoid(v_rel)
+            f[a, 0] -= fric * ny
+            f[a, 1] += fric * nx
+            trq[a] -= fric * rad
+
+    out = np.empty((n, 6))
+    for a in range(n):
+        out[a, 0] = states[a, 3]
+        out[a, 1] = states[a, 4]
+        out[a, 2] = states[a, 5]
+        out[a, 3] = f[a, 0] / props[a, 0]
+        out[a, 4] = f[a, 1] / props[a, 0]
+        out[a, 5] = trq[a] / props[a, 1]
+    return out
+
+
+def physics(states, props, inp, walls, bounds, worlds, safe, rho, k_elastic,
+            spin_drag_ratio, eps, mu, mu_wall, deep_wall, wall_damping):
+    """ Compiled engine.physics - called by it with its model parameters. """
+    states = np.ascontiguousarray(states, np.float64)
+    i, j = shortlist_pairs(states[:, :2], 1., worlds)
+    use_safe = safe is not None
+    if not use_safe:
+        safe = np.zeros((1, 1), bool)
+    xmin, xmax, ymin, ymax = [float(b) for b in bounds]
+    return _derivatives(states, np.ascontiguousarray(props, np.float64),
+                        np.ascontiguousarray(inp, np.float64), walls,
+                        xmin, xmax, ymin, ymax, i, j, safe, use_safe,
+                        rho, k_elastic, spin_drag_ratio, eps, mu, mu_wall,
+                        deep_wall, wall_damping)
+
+
+def check_parity(trials=20, seed=0):
+    """ Assert the compiled backend reproduces the NumPy derivatives. """
+    import engine
+    rng = np.random.RandomState(seed)
+    h, w = 60, 80
+    walls = np.dstack((rng.random_sample((h, w)) * 2,
+                       rng.randn(h, w), rng.randn(h, w)))
+    safe = rng.random_sample((h, w)) < 0.5
+    bounds = [0, 40, 0, 30]
+    for trial in range(trials):
+        n = rng.randint(1, 300)
+        states = np.hstack((rng.random_sample((n, 2)) * [40, 30],
+                            rng.random_sample((n, 1)) * 2 * np.pi,
+                            rng.randn(n, 3) * 5))
+        props = np.vstack((1 + 2*rng.random_sample(n), 0.25*np.ones(n),
+                           np.ones(n), np.ones(n))).T
+        inp = np.hstack((rng.random_sample((n, 1)) * 100,
+                         rng.randn(n, 1) * 10))
+        worlds = rng.randint(0, 3, n) if trial % 2 else None
+        mask = safe if trial % 3 == 0 else None
+        P = states[:, :2]
+        pairs = [set(zip(*np.sort(np.vstack(fn(P, 1., worlds)), axis=0)))
+                 for fn in (engine.shortlist_pairs, shortlist_pairs)]
+        assert pairs[0] == pairs[1], 'broadphase pairs differ'
+        assert np.allclose(engine.linear_interpolate(walls, bounds, P),
+                           linear_interpolate(walls, bounds, P))
+        previous = engine.set_backend('numpy')
+        try:
+            expected = engine.physics(states, props, inp, walls, bounds,
+                                      worlds, mask)
+            engine.set_backend('numba')
+            actual = engine.physics(states, props, inp, walls, bounds,
+                                    worlds, mask)
+        finally:
+            engine.set_backend(previous)
+        assert np.allclose(expected, actual, rtol=1e-9, atol=1e-9), \
+            'derivatives differ by {}'.format(np.abs(expected - actual).max())
+
+
+def main():
+    import engine
+    from time import time
+
+    if not available():
+        print('numba is not installed - nothing to compare')
+        return
+    check_parity()
+    print('Parity OK')
+
+    np.seterr(over='ignore')  # random spawns overlap, saturating sigmoid()
+    rng = np.random.RandomState(1)
+    h, w = 300, 400
+    walls = np.dstack((rng.random_sample((h, w)) * 5,
+                       rng.randn(h, w), rng.randn(h, w)))
+    bounds = [0, 40, 0, 30]
+    for n in (30, 200, 2000):
+        states = np.hstack((rng.random_sample((n, 2)) * [40, 30],
+                            rng.randn(n, 4)))
+        props = np.tile([1., 0.25, 1., 1.], (n, 1))
+        inp = np.tile([100., 3.], (n, 1))
+        timings = []
+        for backend in engine.BACKENDS:
+            engine.set_backend(backend)
+            engine.integrate(states.copy(), props, inp, walls, bounds, 0.004)
+            repeats = max(10, 20000 // n)
+            start = time()
+            for _ in range(repeats):
+                engine.integrate(states.copy(), props, inp, walls, bounds,
+                                 0.004)
+            timings.append(1e6 * (time() - start) / repeats)
+        print('{:5d} ships: '.format(n) + ', '.join(
+            '{} {:8.0f}us/step'.format(b, t)
+            for b, t in zip(engine.BACKENDS, timings)))
+    engine.set_backend('numpy')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+""" Record races to disk, then replay them at full speed and seek anywhere.
+
+    python headless.py ../maps/a/map1 --seed 3 --record race3
+    python replay.py race3 --at 47.0     # ship states 47s in
+    python replay.py race3 --verify      # re-fly it, check every snapshot
+
+A recording is a directory:
+
+    header.json    map, dt, integrator, backend, snapshot interval, seed and
+                   the initial n*6 states and n*4 ship properties
+    controls.bin   n*2 float64 (thrust force, torque) for every tick
+    snapshots.bin  n*6 float64 states after every snapshot_every ticks
+
+Both binary files are appended to as the race runs, one fixed size record
+at a time, so a recording cut short is readable up to its last whole record.
+engine.integrate is deterministic for a given backend and integrator, so
+replays reproduce the race exactly. Seeking starts from the nearest
+snapshot and only simulates the ticks after it.
+"""
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+
+from engine import RaceMap, get_backend, integrate
+
+FORMAT_VERSION = 1
+HEADER = 'header.json'
+CONTROLS = 'controls.bin'
+SNAPSHOTS = 'snapshots.bin'
+DTYPE = np.dtype('<f8')
+
+
+class Recorder:
+    """ Writes a recording as the race runs.
+
+    Args:
+        path - directory to create
+        racemap - engine.RaceMap raced on
+        states0, props - n*6 start states and n*4 ship properties
+        dt - integration time step
+        method - integrator name, see engine.METHODS
+        snapshot_every - ticks between state snapshots
+        seed - spawn seed, for reference
+    """
+
+    def __init__(self, path, racemap, states0, props, dt, method='rk4',
+                 snapshot_every=50, seed=None):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        header = dict(version=FORMAT_VERSION, map=racemap.name,
+                      map_prefix=racemap.prefix, mapscale=racemap.mapscale,
+                      dt=dt, method=method, backend=get_backend(),
+                      snapshot_every=snapshot_every, seed=seed,
+                      n=len(states0), states0=np.asarray(states0).tolist(),
+                      props=np.asarray(props).tolist())
+        with open(os.path.join(path, HEADER), 'w') as f:
+            json.dump(header, f)
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.controls = open(os.path.join(path, CONTROLS), 'wb')
+        self.snapshots = open(os.path.join(path, SNAPSHOTS), 'wb')
+        self.ticks = 0
+
+    def record(self, inp, states):
+        """ Log one tick: the n*2 inputs applied and the states after. """
+        self.controls.write(np.ascontiguousarray(inp, DTYPE).tobytes())
+        self.ticks += 1
+        if self.ticks % self.snapshot_every == 0:
+            self.snapshots.write(np.ascontiguousarray(states,
+                                                      DTYPE).tobytes())
+            # Whole snapshot intervals reach the disk together
+            self.controls.flush()
+            self.snapshots.flush()
+
+    def close(self):
+        self.controls.close()
+        self.snapshots.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _records(filename, shape):
+    # Memory map every whole record (an empty or truncated file is fine)
+    size = os.path.getsize(filename) // (DTYPE.itemsize * int(np.prod(shape)))
+    if size == 0:
+        return np.zeros((0,) + shape, DTYPE)
+    return np.memmap(filename, DTYPE, 'r', shape=(size,) + shape)
+
+
+class Replay:
+    """ Re-fly a recording. The current position is self.tick, with ship
+    states self.states (the state after that many ticks).
+
+    Args:
+        path - recording directory
+        racemap - the map, if it can't be loaded from the header's prefix
+    """
+
+    def __init__(self, path, racemap=None):
+        with open(os.path.join(path, HEADER)) as f:
+            self.header = header = json.load(f)
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported recording version {}'.format(
+                header['version']))
+        if header['backend'] != get_backend():
+            warnings.warn('Recorded on the {} backend but replaying on {}, '
+                          'expect drift'.format(header['backend'],
+                                                get_backend()))
+        n = header['n']
+        self.dt = header['dt']
+        self.method = header['method']
+        self.every = header['snapshot_every']
+        self.states0 = np.array(header['states0'], float).reshape(n, 6)
+        self.props = np.array(header['props'], float).reshape(n, 4)
+        self.controls = _records(os.path.join(path, CONTROLS), (n, 2))
+        self.snapshots = _records(os.path.join(path, SNAPSHOTS), (n, 6))
+        if racemap is None:
+            racemap = RaceMap.load(header['map_prefix'], header['mapscale'])
+        self.racemap = racemap
+        self.rewind()
+
+    @property
+    def ticks(self):
+        return len(self.controls)
+
+    @property
+    def t(self):
+        return self.tick * self.dt
+
+    def rewind(self):
+        self.tick = 0
+        self.states = self.states0.copy()
+
+    def step(self):
+        """ Advance one recorded tick. """
+        integrate(self.states, self.props, self.controls[self.tick],
+                  self.racemap.walls, self.racemap.bounds, self.dt,
+                  method=self.method, safe=self.racemap.safe)
+        self.tick += 1
+
+    def seek(self, tick):
+        """ Move to just after tick ticks, from the nearest snapshot (or the
+        current position, if that's closer). Returns the states there.
+        """
+        if not 0 <= tick <= self.ticks:
+            raise IndexError('Tick {} outside 0..{}'.format(tick, self.ticks))
+        k = min(tick // self.every, len(self.snapshots))
+        if not self.tick <= tick or self.tick < k * self.every:
+            self.tick = k * self.every
+            self.states = (self.snapshots[k - 1] if k else
+                           self.states0).copy()
+        while self.tick < tick:
+            self.step()
+        return self.states
+
+    def seek_time(self, t):
+        return self.seek(int(round(t / self.dt)))
+
+    def frames(self, start=0, stop=None, every=1):
+        """ Yield (tick, states) from start to stop, every few ticks. """
+        stop = self.ticks if stop is None else stop
+        for tick in range(start, stop + 1, every):
+            yield tick, self.seek(tick)
+
+    def verify(self):
+        """ Re-fly the whole recording from the start.
+        Returns:
+            largest difference from any snapshot (0. for an exact replay)
+        """
+        self.rewind()
+        worst = 0.
+        for k, snapshot in enumerate(self.snapshots):
+            while self.tick < (k + 1) * self.every:
+                self.step()
+            worst = max(worst, float(np.abs(self.states - snapshot).max()))
+        return worst
+
+
+def main():
+    from time import time
+
+    parser = argparse.ArgumentParser(description='Spacerace: replay a race')
+    parser.add_argument('path', help='Recording directory')
+    parser.add_argument('--map', default=None,
+                        help='Map prefix, if not where it was recorded')
+    parser.add_argument('--at', type=float, default=None,
+                        help='Print ship states this many seconds in')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check the replay reproduces every snapshot')
+    args = parser.parse_args()
+
+    replay = Replay(args.path)
+    header = replay.header
+    if args.map is not None:
+        replay.racemap = RaceMap.load(args.map, header['mapscale'])
+    print('{} ships on {}, {} ticks of {}s ({:.1f}s), {} snapshots'.format(
+        header['n'], header['map'], replay.ticks, replay.dt,
+        replay.ticks * replay.dt, len(replay.snapshots)))
+
+    if args.at is not None:
+        start = time()
+        states = replay.seek_time(args.at)
+        print('t = {:.2f}s (found in {:.3f}s)'.format(replay.t,
+                                                      time() - start))
+        print('ship        x        y       th       vx       vy        w')
+        for i, s in enumerate(states):
+            print('{:4d} '.format(i) + ' '.join('{:8.3f}'.format(v)
+                                                for v in s))
+
+    if args.verify:
+        start = time()
+        worst = replay.verify()
+        print('Replayed in {:.2f}s, largest snapshot difference {:g}'.format(
+            time() - start, worst))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import matplotlib.pyplot as pl
 import numpy as np
 from numpy.linalg import norm
 from time import time, sleep
+from broadphase import shortlist_pairs
 
 
 def integrate(states, props, inp, bounds, dt):
@@ -47,8 +48,8 @@ def physics(states, props, inp, B):
     trq -= spin_drag_ratio*cd_a * rho * W * np.abs(W) * rad**2
 
     # Inter-ship collisions
-    checks = shortlist_collisions(P, 1.)  # Apply test spatial hashing
-    for i, j in checks:
+    checks = shortlist_pairs(P, 1.)  # Apply test spatial hashing
+    for i, j in zip(*checks):
         dP = P[j] - P[i]
         dist = norm(dP) + eps
         diameter = rad[i] + rad[j]
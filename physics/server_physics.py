@@ -0,0 +1,282 @@
+""" The game server's physics (server/src/physics.hpp) in Python.
+
+engine.physics() is the sandbox's own model and has drifted from what the
+server flies. The server uses linear drag and restitution on separating
+contacts, sets (rather than adds) the force on ships deep in a wall, caps
+the speed used for the position update at VMAX, and wraps theta after every
+step. Its broadphase also only remembers the first ship hashed into each
+bin. This module follows derivatives() and rk4TimeStep() step by step, in
+the server's state layout and float32 precision, so a client can predict
+what the server will do.
+
+Server state layout, one row per ship, in player id order:
+    x, y, vx, vy, theta, omega
+Controls are the raw (Tl, Tr) = (linear in {0, 1}, rotation in {-1, 0, 1}).
+"""
+import numpy as np
+
+F32 = np.float32
+
+# Hard coded in derivatives()
+RADIUS = F32(1.)  # the server ignores ship.radius, maps scale instead
+EPS = F32(1e-5)
+VMAX = F32(40.)
+INERTIA_MASS_RATIO = F32(0.25)
+DEEP_WALL = 0.25  # radii of penetration before the wall force is set
+WALL_DAMPING = 100.
+
+# derivatives() visits corners dx outer, dy inner
+CORNERS = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]], F32)
+
+
+class SimulationParameters:
+    """ readParams(): the server's view of the settings JSON. """
+
+    def __init__(self, settings):
+        sim = settings['simulation']
+        ship, world = sim['ship'], sim['world']
+        self.linear_thrust = F32(ship['linearThrust'])
+        self.linear_drag = F32(world['linearDrag'])
+        self.rotational_thrust = F32(ship['rotationalThrust'])
+        self.rotational_drag = F32(world['rotationalDrag'])
+        self.ship_friction = F32(ship['friction'])
+        self.ship_restitution = F32(ship['restitution'])
+        self.elasticity = F32(world['elasticity'])
+        self.map_scale = F32(world['mapScale'])
+        self.time_step = F32(sim['timeStep'])
+        self.target_fps = sim['targetFPS']
+        self.wall_friction = F32(world['friction'])
+        self.wall_restitution = F32(world['restitution'])
+        self.default_density = F32(ship['defaultDensity'])
+        # runGame(): whole RK4 steps between broadcast frames
+        self.integration_steps = int(1. / float(self.target_fps) /
+                                     float(self.time_step))
+
+
+class ServerMap:
+    """ The map layers physics uses, as loadMaps() holds them.
+
+    Unlike RaceMap the normals are left exactly as the mapbuilder wrote them
+    (not renormalised) and everything stays float32.
+    """
+
+    def __init__(self, name, walldist, wnormx, wnormy):
+        self.name = name
+        self.walldist = walldist
+        self.wnormx = wnormx
+        self.wnormy = wnormy
+
+    @classmethod
+    def load(cls, prefix, mapscale=10.):
+        import os
+        resources = prefix + '_%s.npy'
+        layer = lambda name: np.load(resources % name).astype(F32)
+        return cls(os.path.basename(prefix),
+                   layer('walldist') / F32(mapscale),
+                   layer('wnormx'), layer('wnormy'))
+
+
+def sigmoid(x):
+    # float(-1. + 2./(1. + exp(-x))), evaluated in double
+    return (-1. + 2./(1. + np.exp(-x.astype(float)))).astype(F32)
+
+
+def uint_index(f, top):
+    """ std::max(std::min(uint(f), top), 0) for float32 f.
+    uint() truncates toward zero; anything at or below -1 wraps to a huge
+    unsigned value and so clamps to top, not 0.
+    """
+    i = np.where(f > -1, np.trunc(np.minimum(f, top)), top)
+    return i.astype(np.intp)
+
+
+def interpolate_map(smap, x, y, map_scale):
+    """ interpolate_map(): bilinear wall distance and normal at each ship.
+    Returns:
+        wall_dist, norm_x, norm_y - float32 arrays
+    """
+    h, w = smap.walldist.shape
+    fx = x * map_scale
+    fy = y * map_scale
+    ix = uint_index(fx, w - 2)
+    iy = uint_index(fy, h - 2)
+    alphax = np.clip(fx - ix.astype(F32), F32(0.), F32(1.))
+    alphay = np.clip(fy - iy.astype(F32), F32(0.), F32(1.))
+
+    # The alphas flip in place, the same sequence of float ops as the C++
+    wall_dist = np.zeros(len(x), F32)
+    norm_x = np.zeros(len(x), F32)
+    norm_y = np.zeros(len(x), F32)
+    for dx in (0, 1):
+        alphax = F32(1.) - alphax
+        for dy in (0, 1):
+            alphay = F32(1.) - alphay
+            weight = alphax * alphay
+            wall_dist += weight * smap.walldist[iy + dy, ix + dx]
+            norm_x += weight * smap.wnormx[iy + dy, ix + dx]
+            norm_y += weight * smap.wnormy[iy + dy, ix + dx]
+    return wall_dist, norm_x, norm_y
+
+
+def collision_pairs(P):
+    """ The ship pairs derivatives() actually checks.
+
+    Each ship hashes its four corners (x +- rad, y +- rad) into bins of side
+    2*rad + eps, truncating toward zero. The bins are meant to collect every
+    ship, but the server pushes into a copy of the bin's vector, so a bin
+    only ever holds the first ship that landed in it. Ship i is therefore
+    checked against the lowest-index ship of each of its bins, and two later
+    ships sharing a bin never collide.
+    Returns:
+        i, j - ship indices with j < i (i is the ship being visited)
+    """
+    n = P.shape[0]
+    if n < 2:
+        return np.zeros(0, np.intp), np.zeros(0, np.intp)
+    grid = F32(2. * float(RADIUS) + float(EPS))
+    cells = np.trunc((P[:, np.newaxis, :] + CORNERS * RADIUS) / grid)
+    cells = cells.astype(np.int64).reshape(-1, 2)
+    ship = np.repeat(np.arange(n), len(CORNERS))
+    _, bin_of = np.unique(cells, axis=0, return_inverse=True)
+    bin_of = bin_of.ravel()
+    first = np.full(bin_of.max() + 1, n)
+    np.minimum.at(first, bin_of, ship)
+    j = first[bin_of]
+    keep = j < ship
+    pairs = np.unique(np.vstack((ship[keep], j[keep])).T, axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def derivatives(states, ctrls, masses, params, smap):
+    """ derivatives(): time derivative of float32 server states.
+    Args:
+        states - n*6 (x, y, vx, vy, theta, omega) float32
+        ctrls - n*2 raw (Tl, Tr) controls
+        masses - length n ship densities
+        params - SimulationParameters
+        smap - ServerMap
+    Returns:
+        n*6 float32 derivatives
+    """
+    states = np.asarray(states, F32)
+    ctrls = np.asarray(ctrls, F32)
+    masses = np.asarray(masses, F32)
+    n = states.shape[0]
+    P = states[:, 0:2]
+    V = states[:, 2:4]
+    theta = states[:, 4]
+    w = states[:, 5]
+    rad = RADIUS
+    k_elastic = params.elasticity
+    cd_a_rho = params.linear_drag
+
+    # Forces and torques accumulate in double, like the server's MatrixXd
+    f = np.zeros((n, 2))
+    trq = np.zeros(n)
+
+    # 1. Control
+    thrust = (ctrls[:, 0] * params.linear_thrust).astype(float)
+    f[:, 0] = thrust * np.cos(theta.astype(float))
+    f[:, 1] = thrust * np.sin(theta.astype(float))
+    trq[:] = ctrls[:, 1] * params.rotational_thrust
+
+    # 2. Drag - linear, not quadratic
+    f -= cd_a_rho * V
+    trq -= params.rotational_drag * cd_a_rho * w * rad * rad
+
+    # 3. Inter-ship collisions. Forces on ship j (the earlier ship) land
+    # after ship i's wall step, so keep them apart from i's own
+    f_later = np.zeros((n, 2))
+    i, j = collision_pairs(P)
+    dP = P[j] - P[i]
+    norm = np.sqrt(dP[:, 0]*dP[:, 0] + dP[:, 1]*dP[:, 1])
+    dist = norm + EPS - F32(2.) * rad
+    hit = dist < 0
+    i, j, dP, norm, dist = i[hit], j[hit], dP[hit], norm[hit], dist[hit]
+    if i.size:
+        dPhat = dP / (norm + EPS)[:, np.newaxis]
+        f_magnitude = -dist * k_elastic
+        dV = V[j] - V[i]
+        separating = dV[:, 0]*dP[:, 0] + dV[:, 1]*dP[:, 1] > 0
+        f_magnitude[separating] *= params.ship_restitution
+        f_norm = f_magnitude[:, np.newaxis] * dPhat
+
+        perp = np.vstack((-dPhat[:, 1], dPhat[:, 0])).T
+        v_rel = rad*w[i] + rad*w[j] + (perp[:, 0]*(V[i, 0] - V[j, 0]) +
+                                       perp[:, 1]*(V[i, 1] - V[j, 1]))
+        fric = f_magnitude * params.ship_friction * sigmoid(v_rel)
+        f_fric = fric[:, np.newaxis] * perp
+
+        np.subtract.at(f, i, f_norm)
+        np.add.at(f_later, j, f_norm)
+        np.add.at(f, i, f_fric)
+        np.subtract.at(f_later, j, f_fric)
+        np.subtract.at(trq, i, fric * rad)
+        np.subtract.at(trq, j, fric * rad)
+
+    # 4. Wall single body collisions
+    wall_dist, norm_x, norm_y = interpolate_map(smap, P[:, 0], P[:, 1],
+                                                params.map_scale)
+    dist = wall_dist - rad
+    touching = dist < 0
+    if touching.any():
+        t = touching
+        nx, ny = norm_x[t], norm_y[t]
+        vx, vy = V[t, 0], V[t, 1]
+        f_norm_mag = -dist[t] * k_elastic
+        away = nx*vx + ny*vy > 0
+        f_norm_mag[away] *= params.wall_restitution
+
+        deep = dist[t] <= -float(rad) * DEEP_WALL
+        spring = np.vstack((f_norm_mag * nx, f_norm_mag * ny)).T
+        f_wall = f[t]
+        f_wall[~deep] += spring[~deep]
+        # uh-oh - the server SETs the force and seriously damps velocity
+        f_wall[deep] = spring[deep] - WALL_DAMPING * V[t][deep].astype(float)
+
+        v_rel = w[t] * rad + vx*ny - vy*nx
+        fric = f_norm_mag * params.wall_friction * sigmoid(v_rel)
+        f_wall[:, 0] -= fric * ny
+        f_wall[:, 1] += fric * nx
+        f[t] = f_wall
+        trq[t] -= fric * rad
+    f += f_later
+
+    # Compose the derivatives, position rates capped at VMAX
+    speed = np.sqrt(V[:, 0]*V[:, 0] + V[:, 1]*V[:, 1])
+    fast = speed > VMAX
+    derivs = np.empty((n, 6), F32)
+    derivs[:, 0:2] = V
+    derivs[fast, 0:2] *= (VMAX / speed[fast])[:, np.newaxis]
+    derivs[:, 2] = f[:, 0] / masses
+    derivs[:, 3] = f[:, 1] / masses
+    derivs[:, 4] = w
+    derivs[:, 5] = trq / (INERTIA_MASS_RATIO * masses)
+    return derivs
+
+
+def wrap_theta(states):
+    """ Force theta into [0, 2pi) as rk4TimeStep() does. """
+    theta = np.fmod(states[:, 4].astype(float), 2. * np.pi).astype(F32)
+    negative = theta < 0.
+    theta[negative] = (theta[negative].astype(float) + 2. * np.pi).astype(F32)
+    states[:, 4] = theta
+
+
+def rk4_time_step(states, ctrls, masses, params, smap):
+    """ rk4TimeStep(): one timeStep, float32 states updated in place. """
+    dt = params.time_step
+    half, two, six = F32(0.5), F32(2.), F32(6.)
+    derivs = lambda s: derivatives(s, ctrls, masses, params, smap)
+    k1 = derivs(states)
+    k2 = derivs(states + half*k1*dt)
+    k3 = derivs(states + half*k2*dt)
+    k4 = derivs(states + k3*dt)
+    states += (k1 + two*k2 + two*k3 + k4) * dt / six
+    wrap_theta(states)
+
+
+def step_frame(states, ctrls, masses, params, smap):
+    """ Everything runGame() integrates between two broadcast frames. """
+    for _ in range(params.integration_steps):
+        rk4_time_step(states, ctrls, masses, params, smap)
@@ -0,0 +1,195 @@
+""" Score AI controllers against each other offline, on every core.
+
+    python tournament.py ../maps/a/map1 ../maps/a/map2 \\
+        --controllers mybots:chaser mybots:cautious --seeds 200
+
+Each (map, seed) pair is one race in which every controller flies the same
+number of ships. Races are farmed out to a ProcessPoolExecutor. The map
+layers are loaded once by the parent and placed in shared memory so workers
+attach to them instead of each holding a copy. Ships are scored like the
+server's playerScore(): progress = maxDistance - endDistance.
+"""
+import argparse
+import json
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from time import time
+
+from engine import BACKENDS, METHODS, RaceMap, set_backend
+from headless import HeadlessRace, load_controller, load_settings
+
+LAYERS = ('walls', 'occupancy', 'start', 'end', 'enddist', 'safe')
+
+# Per-worker state, filled in by init_worker()
+_maps = {}
+_settings = None
+
+
+class SharedMaps:
+    """ Map layers copied into shared memory blocks, owned by the parent.
+
+    Use as a context manager so the blocks are unlinked afterwards.
+    """
+
+    def __init__(self, prefixes, mapscale):
+        self.blocks = []
+        self.specs = {}
+        for prefix in prefixes:
+            racemap = RaceMap.load(prefix, mapscale)
+            spec = dict(name=racemap.name, mapscale=mapscale, layers={})
+            for layer in LAYERS:
+                array = getattr(racemap, layer)
+                if array is not None:
+                    spec['layers'][layer] = self._share(array)
+            self.specs[prefix] = spec
+
+    def _share(self, array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+        view[...] = array
+        self.blocks.append(block)
+        return (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(name, shape, dtype):
+    """ Read-only array view onto a parent's shared memory block. """
+    try:
+        # The parent owns (and unlinks) the block, don't track it here
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # python < 3.13
+        block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+def init_worker(specs, settings, backend='numpy'):
+    global _settings
+    _settings = settings
+    set_backend(backend)
+    for prefix, spec in specs.items():
+        blocks, layers = [], {}
+        for layer, desc in spec['layers'].items():
+            block, layers[layer] = attach(*desc)
+            blocks.append(block)  # keep the mappings alive
+        racemap = RaceMap(spec['name'], spec['mapscale'], **layers)
+        _maps[prefix] = (racemap, blocks)
+
+
+class ControllerSet:
+    """ Fly ship i with controller i % k, each one seeing the whole fleet. """
+
+    def __init__(self, controllers, n_ships):
+        self.controllers = controllers
+        self.owner = np.arange(n_ships) % len(controllers)
+
+    def __call__(self, t, states):
+        controls = np.zeros((states.shape[0], 2))
+        for k, controller in enumerate(self.controllers):
+            mine = self.owner == k
+            controls[mine] = controller(t, states)[mine]
+        return controls
+
+
+def run_race(prefix, seed, specs, ships_per_controller, duration, dt,
+             method='rk4'):
+    """ Worker job: one race, returns per-controller progress. """
+    racemap = _maps[prefix][0]
+    n_ships = ships_per_controller * len(specs)
+    controller = ControllerSet([load_controller(s) for s in specs], n_ships)
+    race = HeadlessRace(racemap, n_ships, controller, _settings, dt, seed,
+                        method)
+    stats = race.run(duration)
+    scores = race.scores()
+    winners = race.winners()
+    return dict(map=racemap.name, seed=seed, stats=stats,
+                max_distance=float(racemap.max_distance),
+                scores={s: scores[controller.owner == k].tolist()
+                        for k, s in enumerate(specs)},
+                winner=specs[controller.owner[winners[0]]]
+                if winners.size else None)
+
+
+def summarise(results, specs):
+    """ Mean progress (as a percentage of the track, like updateRanks())
+    and win count per controller.
+    """
+    percent = defaultdict(list)
+    wins = defaultdict(int)
+    for r in results:
+        for spec, scores in r['scores'].items():
+            percent[spec].extend(100. * np.array(scores) / r['max_distance'])
+        if r['winner'] is not None:
+            wins[r['winner']] += 1
+    return {s: dict(mean_score=float(np.mean(percent[s])),
+                    std_score=float(np.std(percent[s])),
+                    wins=wins[s], races=len(results)) for s in specs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spacerace: tournament')
+    parser.add_argument('maps', nargs='+', help='Map prefixes')
+    parser.add_argument('--controllers', nargs='+', required=True,
+                        help='module:function controllers to compete')
+    parser.add_argument('--seeds', type=int, default=10,
+                        help='Races per map')
+    parser.add_argument('--ships-per-controller', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Simulated seconds per race (default: gameTime)')
+    parser.add_argument('--dt', type=float, default=None,
+                        help='Time step (default: timeStep from settings)')
+    parser.add_argument('--integrator', default='rk4',
+                        choices=METHODS)
+    parser.add_argument('--backend', default='numpy', choices=BACKENDS)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--settings', default='../config/spacerace.json')
+    parser.add_argument('--output', default=None,
+                        help='Write every race result to this JSON file')
+    args = parser.parse_args()
+
+    settings = load_settings(args.settings)
+    mapscale = settings['simulation']['world']['mapScale']
+    results = []
+    start = time()
+    with SharedMaps(args.maps, mapscale) as shared, \
+            ProcessPoolExecutor(args.workers, initializer=init_worker,
+                                initargs=(shared.specs, settings,
+                                          args.backend)) as pool:
+        jobs = [pool.submit(run_race, prefix, seed, args.controllers,
+                            args.ships_per_controller, args.duration, args.dt,
+                            args.integrator)
+                for prefix in args.maps for seed in range(args.seeds)]
+        for job in as_completed(jobs):
+            results.append(job.result())
+    elapsed = time() - start
+
+    print('{} races in {:.1f}s ({:.0f} races/hour)'.format(
+        len(results), elapsed, 3600. * len(results) / elapsed))
+    summary = summarise(results, args.controllers)
+    for spec in sorted(summary, key=lambda s: -summary[s]['mean_score']):
+        print('{:40s} {mean_score:6.1f}% +- {std_score:5.1f}  '
+              '{wins} wins / {races}'.format(spec, **summary[spec]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(summary=summary, races=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()